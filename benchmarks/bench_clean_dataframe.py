@@ -0,0 +1,97 @@
+"""
+Benchmark of clean_dataframe: the fused single pass against the previous chained-replace version.
+
+Each variant runs in its own process so the peak RSS of one does not hide the other.
+
+    python benchmarks/bench_clean_dataframe.py --rows 1000000 --cols 200
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def legacy_clean_dataframe(df):
+    """clean_dataframe as it was before the single pass rewrite."""
+    df = df.replace("n.a.", np.nan).replace("n.a", np.nan)
+    df = df.replace({"\r\n": "\n", "\r": '\n'}, regex=True)
+    df = df.replace({"\n": " "}, regex=True)
+    df.columns = df.columns.str.strip().str.replace(' ', '_')
+    df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
+    df = df.dropna(how='all')
+    df = df.dropna(axis=1, how='all')
+    return df
+
+
+def make_frame(rows, cols, seed=0):
+    """Clinical-like frame: 3 in 4 columns are text with NA markers and line breaks, the rest numbers."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(["Colon", "Rectum ", " right", "n.a.", "n.a", "left\r\nside", "yes", "no",
+                           "G2\nhigh", "pT3"], dtype=object)
+    data = {}
+    for c in range(cols):
+        if c % 4 == 3:
+            data[f"num {c}"] = rng.normal(size=rows)
+        else:
+            data[f"text {c}"] = vocabulary[rng.integers(0, len(vocabulary), size=rows)]
+    return pd.DataFrame(data)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant, rows, cols):
+    from cBioportal_study_parser_v3_1 import clean_dataframe
+
+    clean = legacy_clean_dataframe if variant == "legacy" else clean_dataframe
+    df = make_frame(rows, cols)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    clean(df)
+    wall = time.perf_counter() - start
+    return {
+        "variant": variant,
+        "rows": rows,
+        "cols": cols,
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "input_rss_mb": round(rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cols", type=int, default=200)
+    parser.add_argument("--variant", choices=["legacy", "fused"], default=None,
+                        help="run a single variant in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.rows, args.cols)))
+        return
+
+    results = []
+    for variant in ("legacy", "fused"):
+        out = subprocess.run([sys.executable, __file__, "--variant", variant,
+                              "--rows", str(args.rows), "--cols", str(args.cols)],
+                             check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"clean_dataframe on {args.rows} rows x {args.cols} columns")
+    print(f"{'variant':<8} {'wall (s)':>10} {'peak RSS (MB)':>14} {'input RSS (MB)':>15}")
+    for r in results:
+        print(f"{r['variant']:<8} {r['wall_s']:>10} {r['peak_rss_mb']:>14} {r['input_rss_mb']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark of the conversion pipeline, stage by stage, on a synthetic cohort (see synthetic_cohort.py).
+
+Every stage is timed (best of --repeat runs) with the peak RSS after it, the results are written as json.
+Each run is its own process, so the peak RSS is the pipeline's and not the cohort generator's.
+With --baseline the run is compared to an earlier results file and the exit code is 1 when a stage
+got slower or bigger than the tolerance allows.
+
+    python benchmarks/bench_pipeline.py --rows 200000 --output results.json
+    python benchmarks/bench_pipeline.py --rows 200000 --baseline results.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from synthetic_cohort import add_cohort_options, cohort_options, write_cohort  # noqa: E402
+
+STAGES = ["read", "clean", "rename", "select_columns", "compact", "patient_data", "sample_data", "write_patient",
+          "write_sample"]
+# differences below this are timer noise, not regressions
+MIN_SECONDS = 0.05
+MIN_RSS_MB = 20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_pipeline(path, work_dir):
+    """One pass of the conversion steps of _run_conversion(), returns {stage: seconds} and {stage: peak MB}."""
+    import cBioportal_study_parser_v3_1 as parser_v3
+
+    args = {'f': path, 'n': 'bench', 'ct': 'coadread', 'csi': 'bench', 'd': 'bench', 'gat': 'CLINICAL',
+            'wd': work_dir}
+    os.makedirs(os.path.join(work_dir, 'bench'), exist_ok=True)
+    wall, rss = {}, {}
+    state = {}
+
+    def stage(name, func):
+        start = time.perf_counter()
+        value = func()
+        wall[name] = time.perf_counter() - start
+        rss[name] = peak_rss_mb()
+        return value
+
+    df = stage("read", lambda: parser_v3.read_input_file(path, bad_lines='skip', malformed_lines=[]))
+    df = stage("clean", lambda: parser_v3.clean_dataframe(df))
+    df = stage("rename", lambda: parser_v3.rename_columns(df, duplicate_policy='first'))
+    df = df.dropna(subset=['PATIENT_ID', 'SAMPLE_ID'], how='any')
+    patient_columns, sample_columns = stage("select_columns", lambda: parser_v3.select_study_columns(
+        df, parser_v3.PATIENT_COLUMNS, parser_v3.IRRELEVENT_COLUMNS, interactive=False))
+    df = stage("compact", lambda: parser_v3.compact_frame(df))
+    state['p_df'] = stage("patient_data", lambda: parser_v3.prepare_patient_data(df, patient_columns, args))
+    state['s_df'] = stage("sample_data", lambda: parser_v3.prepare_sample_data(df, sample_columns, args))
+    stage("write_patient", lambda: parser_v3.write_clini_data(
+        state['p_df'], "data_clinical_patient.txt", work_dir, 'bench'))
+    stage("write_sample", lambda: parser_v3.write_clini_data(
+        state['s_df'], "data_clinical_sample.txt", work_dir, 'bench'))
+    return wall, rss
+
+
+def run_benchmark(options, repeat):
+    work_dir = tempfile.mkdtemp(prefix="cbio_bench_")
+    try:
+        path = os.path.join(work_dir, "cohort.csv")
+        write_cohort(path, **options)
+        best, peak = {}, {}
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, __file__, "--run", path], check=True, capture_output=True,
+                                 text=True)
+            run = json.loads(out.stdout.strip().splitlines()[-1])
+            for name in STAGES:
+                best[name] = min(best.get(name, run["wall"][name]), run["wall"][name])
+                peak[name] = max(peak.get(name, 0), run["rss"][name])
+        stages = {name: {"wall_s": round(best[name], 4), "peak_rss_mb": round(peak[name], 1)} for name in STAGES}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "cohort": options,
+        "repeat": repeat,
+        "stages": stages,
+        "total_s": round(sum(best.values()), 4),
+        "peak_rss_mb": round(max(peak.values()), 1),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower or bigger than baseline * (1 + tolerance), as printable lines."""
+    regressions = []
+    if baseline.get("cohort") != results["cohort"]:
+        print("Warning: the baseline was measured on another cohort, the comparison is not meaningful.")
+    for name, now in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        if now["wall_s"] > before["wall_s"] * (1 + tolerance) and now["wall_s"] - before["wall_s"] > MIN_SECONDS:
+            regressions.append(f"{name}: {before['wall_s']} s -> {now['wall_s']} s")
+        if (now["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance)
+                and now["peak_rss_mb"] - before["peak_rss_mb"] > MIN_RSS_MB):
+            regressions.append(f"{name}: peak RSS {before['peak_rss_mb']} MB -> {now['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_cohort_options(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest one counts")
+    parser.add_argument("--output", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="results json of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown/growth against the baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--run", default=None, help="run the pipeline once on this csv file (used internally)")
+    args = parser.parse_args()
+
+    if args.run:
+        # the pipeline prints a lot, only the timings go to stdout
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                wall, rss = run_pipeline(args.run, tempfile.mkdtemp(dir=os.path.dirname(args.run)))
+            finally:
+                sys.stdout = stdout
+        print(json.dumps({"wall": wall, "rss": rss}))
+        return 0
+
+    results = run_benchmark(cohort_options(args), max(1, args.repeat))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"pipeline on {args.rows} rows x {args.extra_cols + 10} columns (best of {results['repeat']})")
+    print(f"{'stage':<16} {'wall (s)':>10} {'baseline':>10} {'peak RSS (MB)':>14}")
+    for name, stage in results["stages"].items():
+        before = (baseline or {}).get("stages", {}).get(name, {}).get("wall_s", "")
+        print(f"{name:<16} {stage['wall_s']:>10} {before:>10} {stage['peak_rss_mb']:>14}")
+    print(f"{'total':<16} {results['total_s']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results: {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"no regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
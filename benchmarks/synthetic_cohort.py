@@ -0,0 +1,122 @@
+"""
+Seeded synthetic clinical cohort, written as a csv file that looks like the files the parser gets:
+the usual patient/survival columns, gene status columns, free text with commas and line breaks,
+NA markers, duplicated column names and lines with more fields than the header.
+
+    python benchmarks/synthetic_cohort.py cohort.csv --rows 100000 --extra-cols 40 --malformed-lines 10
+"""
+import argparse
+import csv
+
+import numpy as np
+import pandas as pd
+
+NA_MARKERS = np.array(["n.a.", "n.a", ""], dtype=object)
+FREE_TEXT = np.array(["no evidence of disease", "relapse, liver", "left\r\nside", "G2\nhigh grade",
+                      "pT3, pN1", "seen 2x", " right ", "stable"], dtype=object)
+CATEGORIES = np.array(["Colon", "Rectum", "Sigmoid", "Caecum", "unknown"], dtype=object)
+
+
+def make_cohort_frame(rows, extra_cols=20, na_density=0.1, newline_rate=0.01, duplicate_columns=2,
+                      samples_per_patient=2, seed=0):
+    """
+    The cohort as a DataFrame of text and numbers. newline_rate is the share of free text cells with a
+    line break or a comma, duplicate_columns extra columns get the name of an earlier column.
+    """
+    rng = np.random.default_rng(seed)
+    patients = np.arange(rows) // samples_per_patient
+    data = {
+        "PATIENT": np.char.add("P ", patients.astype(str)),
+        "SAMPLE_ID": np.char.add("S-", np.arange(rows).astype(str)),
+        "AGE": rng.integers(25, 90, size=patients.max() + 1)[patients],
+        "GENDER": np.array(["F", "M"], dtype=object)[rng.integers(0, 2, size=patients.max() + 1)][patients],
+        "OS_MONTHS": np.round(rng.exponential(40, size=rows), 1),
+        "OS_STATUS": rng.integers(0, 3, size=rows),
+        "DSE_E": rng.integers(0, 2, size=rows),
+        "DFS_months": np.round(rng.exponential(30, size=rows), 1),
+        "KRAS": np.array(["mut", "wt"], dtype=object)[(rng.random(rows) < 0.4).astype(int) ^ 1],
+        "BRAF": np.array(["mut", "wt"], dtype=object)[(rng.random(rows) < 0.1).astype(int) ^ 1],
+    }
+    plain_text = FREE_TEXT[[0, 4, 5, 6, 7]]
+    for c in range(extra_cols):
+        kind = c % 3
+        if kind == 0:
+            text = plain_text[rng.integers(0, len(plain_text), size=rows)]
+            messy = rng.random(rows) < newline_rate
+            text[messy] = FREE_TEXT[rng.integers(0, len(FREE_TEXT), size=int(messy.sum()))]
+            data[f"Note {c}"] = text
+        elif kind == 1:
+            data[f"Site {c}"] = CATEGORIES[rng.integers(0, len(CATEGORIES), size=rows)]
+        else:
+            data[f"Score {c}"] = np.round(rng.normal(50, 15, size=rows), 2)
+
+    df = pd.DataFrame(data)
+    # NA markers in every column but the ids
+    for col in df.columns[2:]:
+        missing = rng.random(rows) < na_density
+        if missing.any():
+            df[col] = df[col].astype(object)
+            df.loc[missing, col] = NA_MARKERS[rng.integers(0, len(NA_MARKERS), size=int(missing.sum()))]
+
+    extra = [col for col in data if col.split(" ")[0] in ("Note", "Site", "Score")]
+    names = list(df.columns)
+    for i in range(min(duplicate_columns, len(extra) - 1)):
+        names[names.index(extra[-1 - i])] = extra[i]
+    df.columns = names
+    return df
+
+
+def write_cohort(path, malformed_lines=0, seed=0, **frame_options):
+    """
+    Writes the cohort to path. malformed_lines random rows get one field more than the header,
+    like a free text cell with an unquoted comma. Returns the DataFrame that was written.
+    """
+    df = make_cohort_frame(seed=seed, **frame_options)
+    rng = np.random.default_rng(seed + 1)
+    malformed = np.sort(rng.choice(len(df), size=min(malformed_lines, len(df)), replace=False))
+    with open(path, "w", newline="") as f:
+        df.iloc[:0].to_csv(f, index=False)
+        writer = csv.writer(f, lineterminator="\n")
+        start = 0
+        for row in malformed.tolist():
+            df.iloc[start:row].to_csv(f, index=False, header=False, lineterminator="\n")
+            writer.writerow(list(df.iloc[row]) + ["unquoted, comma"])
+            start = row + 1
+        df.iloc[start:].to_csv(f, index=False, header=False, lineterminator="\n")
+    return df
+
+
+def add_cohort_options(parser):
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--extra-cols", type=int, default=20, help="columns on top of the clinical ones")
+    parser.add_argument("--na-density", type=float, default=0.1, help="share of NA markers per cell")
+    parser.add_argument("--newline-rate", type=float, default=0.01,
+                        help="share of free text cells with a line break or a comma")
+    parser.add_argument("--duplicate-columns", type=int, default=2)
+    parser.add_argument("--malformed-lines", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def cohort_options(args):
+    return {
+        "rows": args.rows,
+        "extra_cols": args.extra_cols,
+        "na_density": args.na_density,
+        "newline_rate": args.newline_rate,
+        "duplicate_columns": args.duplicate_columns,
+        "malformed_lines": args.malformed_lines,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    add_cohort_options(parser)
+    args = parser.parse_args()
+    df = write_cohort(args.path, **cohort_options(args))
+    print(f"{args.path}: {len(df)} rows x {len(df.columns)} columns, {args.malformed_lines} malformed lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+import cBioportal_study_parser_v3_1 as parser_v3
+
+
+MANIFEST_FIELDS = ['file', 'study_name', 'cancer_type', 'cancer_study_identifier', 'description',
+                   'genetic_alteration_type']
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Convert all the studies listed in a manifest into cBioPortal studies.")
+    parser.add_argument("-m", "--manifest", dest='manifest', type=str, required=True,
+                        help='csv, yaml or json manifest with the columns ' + ', '.join(MANIFEST_FIELDS) +
+                             ' (any other StudyConfig field can be added as a column)')
+    parser.add_argument("-wd", '--work-dir', dest='wd', type=str, default='./',
+                        help='target_dir, every study gets its own directory in it')
+    parser.add_argument("-j", "--jobs", dest='jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of studies converted at the same time (default: number of cores)')
+    parser.add_argument("--report", dest='report', type=str, default='batch_summary.json',
+                        help='Summary report written into the work dir (default: batch_summary.json)')
+    parser.add_argument("--dry-run", dest='dry_run', action='store_true',
+                        help="Only check the manifest, the configs and the header of every input file")
+    parser_v3.add_conversion_options(parser)
+    return parser.parse_args(argv)
+
+
+def read_manifest(path):
+    """Rows of the manifest as dicts of StudyConfig fields."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            rows = json.load(f) or []
+        if isinstance(rows, dict):
+            rows = rows.get('studies', [])
+    elif path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            print("Error: reading a yaml manifest needs PyYAML (uv pip install pyyaml), or use a csv manifest.")
+            exit(1)
+        with open(path) as f:
+            rows = yaml.safe_load(f) or []
+        if isinstance(rows, dict):
+            rows = rows.get('studies', [])
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    for i, row in enumerate(rows, 1):
+        # yaml/json manifests can give lists and mappings (status_codes, case_lists, ...), those are kept
+        row = {k.strip(): (v.strip() if isinstance(v, str) else '' if v is None else v) for k, v in row.items() if k}
+        for key in MANIFEST_FIELDS:
+            # a yaml study_name like 2024 is read as a number
+            if isinstance(row.get(key), (int, float)):
+                row[key] = str(row[key])
+        unknown = set(row) - {f.name for f in parser_v3.fields(parser_v3.StudyConfig)}
+        if unknown:
+            print(f"Error: manifest entry {i} has unknown columns {sorted(unknown)}.")
+            exit(1)
+        if not row.get('file') or not row.get('study_name'):
+            print(f"Error: manifest entry {i} needs at least 'file' and 'study_name'.")
+            exit(1)
+        # relative input paths are relative to the manifest, not to where the batch is started
+        row['file'] = os.path.join(os.path.dirname(os.path.abspath(path)), row['file'])
+        entries.append(row)
+
+    names = [row['study_name'] for row in entries]
+    duplicated = sorted({n for n in names if names.count(n) > 1})
+    if duplicated:
+        print(f"Error: study names must be unique in the manifest, found {duplicated} more than once.")
+        exit(1)
+    return entries
+
+
+def study_config(entry, options):
+    """StudyConfig of a manifest entry, the command line options apply to every study."""
+    values = dict(entry)
+    values['work_dir'] = options.wd
+    values.update(parser_v3.conversion_settings(options))
+    return parser_v3.StudyConfig.from_dict(values)
+
+
+def convert_one(config):
+    """Runs one study unattended, its output goes to conversion.log in the study directory."""
+    study_dir = os.path.join(config.work_dir, config.study_name)
+    os.makedirs(study_dir, exist_ok=True)
+    log_path = os.path.join(study_dir, 'conversion.log')
+    result = {'study': config.study_name, 'file': config.file, 'status': 'ok', 'error': None, 'log': log_path}
+    start = time.perf_counter()
+    try:
+        with open(log_path, 'w') as log, redirect_stdout(log):
+            study = parser_v3.convert_study(config)
+        if study.skipped:
+            result['status'] = 'skipped'
+        result['rows'] = study.rows
+        result['files'] = study.files
+        result['malformed_lines'] = len(study.malformed_lines)
+        result['conflicts'] = len(study.conflicts)
+        result['stages'] = study.stages
+        if config.validate_output and not study.skipped:
+            result['validation_errors'] = sum(issue.level == 'ERROR' for issue in study.validation)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(entries, options):
+    """Converts the studies on a pool of options.jobs processes, results are in manifest order."""
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, options.jobs)) as pool:
+        futures = {pool.submit(convert_one, study_config(entry, options)): entry['study_name']
+                   for entry in entries}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker process itself died (out of memory, killed, ...)
+                result = {'study': name, 'status': 'failed', 'error': f"{type(e).__name__}: {e}", 'seconds': None}
+            results[name] = result
+            print(f"[{len(results)}/{len(entries)}] {name}: {result['status']} ({result['seconds']} s)")
+    return [results[entry['study_name']] for entry in entries]
+
+
+def write_report(results, options, wall):
+    report_path = os.path.join(options.wd, options.report)
+    failed = [r for r in results if r['status'] == 'failed']
+    skipped = [r for r in results if r['status'] == 'skipped']
+    report = {
+        'manifest': options.manifest,
+        'studies': len(results),
+        'failed': len(failed),
+        'skipped': len(skipped),
+        'wall_seconds': round(wall, 3),
+        'results': results,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{len(results) - len(failed)} of {len(results)} studies converted ({len(skipped)} unchanged) "
+          f"in {wall:.1f} s, report: {report_path}")
+    for r in failed:
+        print(f"  FAILED {r['study']}: {r['error']}")
+    return report_path
+
+
+def main():
+    options = parse_arguments()
+    entries = read_manifest(options.manifest)
+    try:
+        for entry in entries:
+            study_config(entry, options).validate()
+    except parser_v3.StudyConversionError as e:
+        print(f"Error in the manifest: {e}")
+        return 1
+    if options.dry_run:
+        failed = 0
+        for entry in entries:
+            try:
+                parser_v3.dry_run(study_config(entry, options))
+            except parser_v3.StudyConversionError as e:
+                failed += 1
+                print(f"  FAILED {entry['study_name']}: {e}")
+        print(f"\n{len(entries) - failed} of {len(entries)} studies can be converted.")
+        return 1 if failed else 0
+    os.makedirs(options.wd, exist_ok=True)
+    print(f"Converting {len(entries)} studies with {options.jobs} parallel jobs...")
+    start = time.perf_counter()
+    results = run_batch(entries, options)
+    write_report(results, options, time.perf_counter() - start)
+    return 1 if any(r['status'] == 'failed' for r in results) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
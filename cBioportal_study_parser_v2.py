@@ -1,9 +1,17 @@
-import pandas as pd
-import numpy as np
 import argparse
 import os
 from os.path import exists
 
+from cBioportal_study_parser_v3_1 import (GENE_SYMBOLS, CaseLists, GeneMatrix, RecordIndex, RenameRules, TsvWriter,
+                                          clini_column_types, clini_header, detect_gene_columns, lazy_import,
+                                          load_gene_list, map_status_codes, write_gene_matrix)
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# spaces in the ids become underscores, before the rules of a synonyms file
+ID_RULES = [(' ', '_')]
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
@@ -14,57 +22,22 @@ def parse_arguments():
     parser.add_argument("-d", "--description", dest='d', type=str, default='No description provided', help='Description of the study')
     parser.add_argument("-gat", '--genetic-alteration-type', dest='gat', type=str, default='CLINICAL', help='genetic-alteration-type')
     parser.add_argument("-wd", '--work-dir', dest='wd', type=str, default='./', help='target_dir for study creation')
+    parser.add_argument("-gp", '--gene-panel', dest='gp', type=str, default=None, help='Gene panel stable id (default: <study name>_panel)')
+    parser.add_argument("-gl", '--gene-list', dest='gl', type=str, default=None, help='File with the HUGO symbols of the gene columns, one per line')
+    parser.add_argument("-sy", '--synonyms', dest='sy', type=str, default=None, help='json/yaml file with more column aliases and id rules')
     return parser.parse_args()
 
 
-def write_gene_data(df, output_file, work_dir, study_name):
+def write_gene_data(matrix, args):
     print("Writing gene panel data...")
-    full_path = os.path.join(work_dir, study_name, output_file)
-    with open(full_path, "w") as f:
-        f.write("\t".join(df.columns) + "\n")
-        for _, row in df.iterrows():
-            f.write("\t".join(row.astype(str)) + "\n")
+    write_gene_matrix(matrix, vars(args), args.gp or f"{args.n}_panel")
 
 def write_clini_data(df, f_name, work_dir, study_name):
     print(f"Writing columns for {f_name}: {list(df.columns)}")  # Log the column names
-    df_cols = "\t".join(list(df.columns))
-    cols = '#' + df_cols + '\n'
-
-    column_types = []
-    for col in df.columns:
-        if col in ["T_STATUS", "TUMOR_STATUS", "METASTATIC_SITE"]:
-            col_type = "STRING"
-        elif col == "AGE":
-            col_type = "NUMBER"
-        elif col.endswith("_MONTHS") or col.lower().endswith("months"):
-            col_type = "NUMBER"
-        #elif df[col].dropna().astype(str).str.lower().isin(["yes", "no", "true", "false"]).all():
-            #col_type = "BOOLEAN"
-            # Convert BOOLEAN values to uppercase strings
-            df[col] = df[col].astype(str).str.lower().map({
-                "yes": "TRUE", 
-                "no": "FALSE", 
-                "true": "TRUE", 
-                "false": "FALSE"
-            })
-        else:
-            col_type = "STRING"
-        column_types.append(col_type)
-        print(f"Column '{col}' assigned type: {col_type}")
-
-    sample_header = [
-        cols,
-        cols,
-        "#" + "\t".join(column_types) + '\n',
-        "#" + "\t".join(["1" for _ in range(len(list(df.columns)))]) + '\n',
-        df_cols.upper() + '\n'
-    ]
-
-    df = df.to_csv(header=None, index=False, sep="\t",lineterminator='\n')
-  
-    with open(f"{os.path.join(work_dir, study_name)}/{f_name}", "w") as f:
-        f.writelines(sample_header)
-        f.write(df)
+    # the types come from the values, as in v3 (BOOLEAN columns are rewritten as TRUE/FALSE)
+    column_types = clini_column_types(df)
+    with TsvWriter(os.path.join(work_dir, study_name, f_name), clini_header(df.columns, column_types)) as writer:
+        writer.write(df)
 
 def prepare_meta_study(args):
     meta_study_content = [
@@ -72,8 +45,8 @@ def prepare_meta_study(args):
         f"cancer_study_identifier: {args.csi}\n",
         f"name: {args.n}\n",
         f"description: {args.d}\n",
-        f"add_global_case_list: true\n"
-        f"reference_genome: hg38"
+        f"add_global_case_list: false\n"
+        f"reference_genome: hg38\n"
     ]
     with open(f"{os.path.join(args.wd, args.n)}/meta_study.txt", 'w') as f:
         f.writelines(meta_study_content)
@@ -88,24 +61,12 @@ def clean_dataframe(df):
     df = df.dropna(axis=1, how='all')  
     return df
 
-def rename_columns(df):
-    if 'PATIENT' in df.columns:
-        df.rename(columns={'PATIENT': 'PATIENT_ID'}, inplace=True)
-    if 'DSE_E' in df.columns:
-        df.rename(columns={'DSE_E': 'DFS_STATUS'}, inplace=True)
-    if 'DFS_months' in df.columns:
-        df.rename(columns={'DFS_months': 'DFS_MONTHS'}, inplace=True)
-    if 'death_event' in df.columns:
-        df.rename(columns={'death_event': 'OS_STATUS'}, inplace=True)
-    if 'GENDER' in df.columns:
-        df.rename(columns={'GENDER': 'SEX'}, inplace=True)
-    if 'DFS_STATUS_' in df.columns:
-        df.rename(columns={'DFS_STATUS_': 'DFS_STATUS'}, inplace=True)
+def rename_columns(df, rules):
+    df.columns = rules.rename(df.columns)
     if 'SAMPLE_ID' not in df.columns:
         df['SAMPLE_ID'] = df['PATIENT_ID']
-    df['PATIENT_ID'].replace(' ', '_', regex=True, inplace=True)
-    if 'SAMPLE_ID' in df.columns:
-        df['SAMPLE_ID'].replace(' ', '_', regex=True, inplace=True)
+    df['PATIENT_ID'] = rules.normalize_ids(df['PATIENT_ID'])
+    df['SAMPLE_ID'] = rules.normalize_ids(df['SAMPLE_ID'])
     return df
 
 def prepare_patient_data(df, patient_columns, sample_columns, args):
@@ -116,24 +77,15 @@ def prepare_patient_data(df, patient_columns, sample_columns, args):
         f"cancer_study_identifier: {args.csi}\n",
         f"genetic_alteration_type: {args.gat}\n",
         f"datatype: PATIENT_ATTRIBUTES\n",
-        "data_filename: data_clinical_patient.txt"
+        "data_filename: data_clinical_patient.txt\n"
     ]
     with open(f"{os.path.join(args.wd, args.n)}/meta_clinical_patient.txt", 'w') as f:
         f.writelines(meta_clinical_patient_content)
 
-    p_df = df.filter(patient_columns, axis=1)
-    
-    for c in p_df.columns:
-      if c.upper() == "OS_STATUS":
-          p_df[c] = p_df[c].astype(str)
-          p_df.loc[p_df[c] == "0", c] = "0:LIVING"
-          p_df.loc[p_df[c] == "1", c] = "1:DECEASED"
-          p_df.loc[p_df[c] == "2", c] = "1:DECEASED"
-      if c.upper() == "DFS_STATUS":
-          p_df[c] = p_df[c].astype(str)
-          p_df.loc[p_df[c] == "0", c] = "0:DiseaseFree"
-          p_df.loc[p_df[c] == "1", c] = "1:Recurred"
-    p_df.drop_duplicates(inplace=True)
+    p_df = map_status_codes(df.filter(patient_columns, axis=1))
+    patient_index = RecordIndex('PATIENT_ID')
+    p_df = patient_index.dedupe(p_df)
+    patient_index.report("data_clinical_patient.txt")
     return p_df
 
 def prepare_sample_data(df, patient_columns, args):
@@ -144,26 +96,15 @@ def prepare_sample_data(df, patient_columns, args):
         f"cancer_study_identifier: {args.csi}\n",
         f"genetic_alteration_type: {args.gat}\n",
         f"datatype: SAMPLE_ATTRIBUTES\n",
-        "data_filename: data_clinical_sample.txt"
+        "data_filename: data_clinical_sample.txt\n"
     ]
     with open(f"{os.path.join(args.wd, args.n)}/meta_clinical_sample.txt", 'w') as f:
         f.writelines(meta_clinical_sample_content)
     return sample_df
 
 def prepare_gene_data(df, gene_columns, args):
-    print("Removing patient-specific columns from sample data from mutataion data...")
-    gene_df=df[gene_columns]
-
-    meta_gene_sample_content = [
-        f"cancer_study_identifier: {args.csi}\n",
-        f"genetic_alteration_type: {args.gat}\n",
-        f"datatype: SAMPLE_ATTRIBUTES\n",
-        "data_filename: data_gene_panel_matrix.txt"
-    ]
-    with open(f"{os.path.join(args.wd, args.n)}/meta_gene_panel_matrix.txt", 'w') as f:
-        f.writelines(meta_gene_sample_content)
-        
-    return gene_df
+    print(f"Found gene columns: {gene_columns}")
+    return GeneMatrix.from_frame(df, gene_columns)
 
 
 def read_input_file(file_path):
@@ -188,7 +129,8 @@ def main():
 
     sample_columns = ['PATIENT_ID', 'SAMPLE_ID', 'CANCER_TYPE', 'CANCER_TYPE_DETAILED', 'TUMOR_TISSUE_SITE', 'SAMPLE_DISPLAY_NAME', 'SAMPLE_CLASS', 'METASTATIC_SITE', 'OTHER_SAMPLE_ID','BRAF','KRAS']
     patient_columns = ['PATIENT_ID', 'AGE', 'SEX', 'DFS_MONTHS', 'OS_MONTHS', 'OS_STATUS', 'DFS_STATUS', 'TUMOR_SITE']
-    gene_collums =['SAMPLE_ID','BRAF','KRAS']  
+    genes = load_gene_list(args.gl) if args.gl else GENE_SYMBOLS
+    rules = RenameRules.from_file(args.sy, ID_RULES) if args.sy else RenameRules(id_rules=ID_RULES)
 
     if not exists(os.path.join(args.wd, args.n)):
         os.mkdir(os.path.join(args.wd, args.n))
@@ -198,7 +140,7 @@ def main():
     df = read_input_file(args.f)
 
     df = clean_dataframe(df)
-    df = rename_columns(df)
+    df = rename_columns(df, rules)
 
     key_columns = ['PATIENT_ID', 'SAMPLE_ID']
     df = df.dropna(subset=key_columns, how='any')
@@ -207,7 +149,7 @@ def main():
 
     Found_patient_columns = [col for col in patient_columns if col in df.columns]
     Found_sample_columns = [col for col in sample_columns if col in df.columns]
-    Found_gene_columns=[col for col in gene_collums if col in df.columns]
+    Found_gene_columns = detect_gene_columns(df.columns, genes)
 
     if Found_patient_columns:
         p_df = prepare_patient_data(df, Found_patient_columns, Found_sample_columns, args)
@@ -216,10 +158,12 @@ def main():
     sample_df = prepare_sample_data(df, patient_columns, args)
     write_clini_data(sample_df, "data_clinical_sample.txt", args.wd, args.n)
     
-    gene_df = prepare_gene_data(df, Found_gene_columns, args)
-    print(gene_df)
-    
-    write_gene_data(gene_df, "data_gene_panel_matrix.txt", args.wd, args.n)
+    gene_matrix = None
+    if Found_gene_columns:
+        gene_matrix = prepare_gene_data(df, Found_gene_columns, args)
+        write_gene_data(gene_matrix, args)
+
+    CaseLists().write(vars(args), sample_df['SAMPLE_ID'].unique(), gene_matrix)
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,79 @@
-import pandas as pd
-import numpy as np
-import csv
-from io import StringIO
+import argparse
+import gc
+import hashlib
+import importlib.util
+import itertools
+import json
+import logging
 import os
-from collections import Counter
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+import sys
+import multiprocessing as mp
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field, fields, replace
 from os.path import exists
 
+
+def lazy_import(name):
+    """
+    The module, loaded on its first attribute access. pandas and numpy take about half a second
+    to import, which --help, the config checks and --dry-run do not need.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+PATIENT_COLUMNS = ['PATIENT_ID', 'AGE', 'SEX', 'DFS_MONTHS', 'OS_MONTHS', 'OS_STATUS', 'DFS_STATUS', 'TUMOR_SITE','study','compassid','pooledcompassid']
+IRRELEVENT_COLUMNS = ['Relative_Path_1','Relative_Path_2']
+DUPLICATE_COLUMN_POLICIES = ['ask', 'first', 'last', 'abort']
+PREVIEW_FORMATS = ['parquet', 'csv', 'xlsx']
+PREVIEW_ROWS = 1000
+# always written as STRING, whatever their values look like
+STRING_COLUMNS = ['PATIENT_ID', 'SAMPLE_ID', 'T_STATUS', 'TUMOR_STATUS', 'METASTATIC_SITE']
+BOOLEAN_VALUES = {'yes': 'TRUE', 'no': 'FALSE', 'true': 'TRUE', 'false': 'FALSE'}
+# values looked at before a column type is checked against the whole column
+PROFILE_SAMPLE_SIZE = 1000
+# rows converted to text per batch and write buffer of the data files
+TSV_BATCH_ROWS = 50000
+# conflicting patient/sample rows kept with their details, the rest are only counted
+MAX_CONFLICT_DETAILS = 1000
+TSV_BUFFER_SIZE = 1 << 22
+# meta and data files written at the same time, see OutputQueue
+OUTPUT_THREADS = 4
+# raw value -> cBioPortal code of the survival status columns, extended with the status_codes config key
+STATUS_CODES = {
+    'OS_STATUS': {'0': '0:LIVING', '1': '1:DECEASED', '2': '1:DECEASED'},
+    'DFS_STATUS': {'0': '0:DiseaseFree', '1': '1:Recurred'},
+}
+METRICS_FORMATS = ['jsonl', 'prometheus']
+LOG_LEVELS = ['debug', 'info', 'warning']
+
+# the per-column messages are debug messages, --log-level debug shows them
+logger = logging.getLogger("cbioportal_study_parser")
+
+
+class StudyConversionError(Exception):
+    """A study could not be converted, the message says why."""
+
+
 def parse_arguments():
     f = input("Enter the Clinical data Excel or csv file path : ") 
     n = input("Enter the name of the study:  ") 
@@ -23,109 +91,1055 @@ def parse_arguments():
         'gat': gat,
         'wd': wd
     }
+
+
+def _column_list(value):
+    """Comma separated string (command line, csv manifest) or list (json/yaml) of column names."""
+    if value is None or isinstance(value, list):
+        return value
+    return [col.strip() for col in str(value).split(",") if col.strip()]
+
+
+@dataclass
+class StudyConfig:
+    """
+    Everything a conversion needs, so it can run without asking any question.
+    Field names match the batch manifest columns and the keys of a json/yaml config file.
+    """
+    file: str
+    study_name: str
+    cancer_type: str = 'coadread'
+    cancer_study_identifier: str = None
+    description: str = None
+    genetic_alteration_type: str = 'CLINICAL'
+    work_dir: str = './'
+    # keep the text columns as pyarrow backed strings from reading to writing
+    arrow_strings: bool = False
+    # excel sheet, by index or name
+    sheet: object = 0
+    # keep a parquet copy of the sheet next to the workbook so later runs skip excel parsing
+    excel_cache: bool = True
+    # malformed csv lines: 'skip', 'truncate', 'drop' (the drop_columns indices), 'abort' or 'ask'
+    bad_lines: str = 'skip'
+    drop_columns: list = None
+    # which copy of a duplicated column is kept: 'first', 'last', 'abort' or 'ask'
+    duplicate_columns: str = 'first'
+    irrelevant_columns: list = field(default_factory=lambda: list(IRRELEVENT_COLUMNS))
+    patient_columns: list = field(default_factory=lambda: list(PATIENT_COLUMNS))
+    # None takes every column that is neither a patient nor an irrelevant column
+    sample_columns: list = None
+    # gene panel matrix: written when gene_panel (the panel stable id) is set, gene_columns are found
+    # with the gene_list file (one HUGO symbol per line, default GENE_SYMBOLS) unless they are given
+    gene_panel: str = None
+    gene_list: str = None
+    gene_columns: list = None
+    # json/yaml file of column aliases and id normalization rules shared by the studies, see RenameRules
+    synonyms: str = None
+    # json file keeping the normalized values of the categorical columns between runs, see Vocabulary
+    vocabulary_cache: str = None
+    # check the written study with cBioportal_study_validator, the issues go to StudyResult.validation
+    validate_output: bool = False
+    # more status columns or values, {column: {raw value: cBioPortal code}} on top of STATUS_CODES
+    status_codes: dict = None
+    # case lists on top of cases_all/cases_sequenced, {suffix: {'name', 'description', 'where': {column: values}}}
+    case_lists: dict = None
+    chunksize: int = None
+    workers: int = 1
+    # files written at the same time, 1 writes them one after another
+    output_threads: int = OUTPUT_THREADS
+    # skip the study when neither the input nor the config changed, rewrite only changed files
+    incremental: bool = False
+    # preview of the cleaned rows in the study directory: 'parquet', 'csv', 'xlsx' or None for none
+    preview: str = None
+    preview_rows: int = PREVIEW_ROWS
+    # instrumentation: stage metrics written to the study directory ('jsonl' or 'prometheus'),
+    # a profile of the whole run (.prof for cProfile, .html for pyinstrument) and the log level
+    metrics: str = None
+    profile: str = None
+    log_level: str = 'info'
+    interactive: bool = False
+
+    @classmethod
+    def from_dict(cls, values):
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            raise StudyConversionError(f"Unknown config keys: {sorted(unknown)}")
+        values = {k: v for k, v in values.items() if v is not None and v != ''}
+        for key in ('irrelevant_columns', 'patient_columns', 'sample_columns', 'gene_columns'):
+            if key in values:
+                values[key] = _column_list(values[key])
+        if 'drop_columns' in values:
+            values['drop_columns'] = [int(i) for i in _column_list(values['drop_columns'])]
+        for key in ('chunksize', 'workers', 'output_threads', 'preview_rows'):
+            if key in values:
+                values[key] = int(values[key])
+        for key in ('incremental', 'excel_cache', 'arrow_strings', 'validate_output'):
+            if isinstance(values.get(key), str):
+                values[key] = values[key].strip().lower() in ('1', 'true', 'yes', 'y')
+        for key in ('status_codes', 'case_lists'):
+            if isinstance(values.get(key), str):
+                # a json object in a csv manifest cell
+                try:
+                    values[key] = json.loads(values[key])
+                except ValueError as e:
+                    raise StudyConversionError(f"{key} is not valid json: {e}")
+        try:
+            return cls(**values)
+        except TypeError as e:
+            raise StudyConversionError(f"Invalid config: {e}")
+
+    def args(self):
+        """The args dict the conversion functions work with (same defaults as the prompts)."""
+        return {
+            'f': self.file,
+            'n': self.study_name,
+            'ct': self.cancer_type,
+            'csi': self.cancer_study_identifier or self.study_name,
+            'd': self.description or self.study_name,
+            'gat': self.genetic_alteration_type,
+            'wd': self.work_dir,
+        }
+
+    def rename_rules(self):
+        """The RenameRules of the study, RENAME_MAP alone without a synonyms file."""
+        return RenameRules.from_file(self.synonyms) if self.synonyms else DEFAULT_RENAME_RULES
+
+    def validate(self):
+        if not self.file or not self.study_name:
+            raise StudyConversionError("The config needs at least 'file' and 'study_name'.")
+        if self.bad_lines not in BAD_LINE_POLICIES:
+            raise StudyConversionError(f"bad_lines must be one of {BAD_LINE_POLICIES}, not '{self.bad_lines}'")
+        if self.bad_lines == 'drop' and not self.drop_columns and not self.interactive:
+            raise StudyConversionError("bad_lines 'drop' needs the drop_columns indices.")
+        if self.duplicate_columns not in DUPLICATE_COLUMN_POLICIES:
+            raise StudyConversionError(
+                f"duplicate_columns must be one of {DUPLICATE_COLUMN_POLICIES}, not '{self.duplicate_columns}'")
+        if not self.interactive and 'ask' in (self.bad_lines, self.duplicate_columns):
+            raise StudyConversionError("'ask' policies need interactive=True.")
+        if self.incremental and self.interactive:
+            raise StudyConversionError("incremental runs need every decision in the config, they cannot be interactive.")
+        if self.status_codes is not None and not (
+                isinstance(self.status_codes, dict) and all(isinstance(v, dict) for v in self.status_codes.values())):
+            raise StudyConversionError("status_codes must map column names to {raw value: cBioPortal code} tables.")
+        if self.case_lists is not None:
+            if not isinstance(self.case_lists, dict):
+                raise StudyConversionError("case_lists must map a case list suffix to its definition.")
+            for suffix, definition in self.case_lists.items():
+                if not re.fullmatch(r"[\w.-]+", str(suffix)) or suffix in RESERVED_CASE_LISTS:
+                    raise StudyConversionError(f"'{suffix}' cannot be a case list suffix.")
+                if not isinstance(definition, dict) or not isinstance(definition.get('where'), dict) \
+                        or not definition['where']:
+                    raise StudyConversionError(f"Case list '{suffix}' needs a 'where' of {{column: values}}.")
+        if self.synonyms and not exists(self.synonyms):
+            raise StudyConversionError(f"The synonyms file {self.synonyms} was not found.")
+        if self.gene_list and not exists(self.gene_list):
+            raise StudyConversionError(f"The gene list {self.gene_list} was not found.")
+        if self.gene_panel is not None and not re.fullmatch(r"[\w.-]+", self.gene_panel):
+            raise StudyConversionError(f"gene_panel must be a stable id (letters, digits, _ . -), not '{self.gene_panel}'")
+        if self.metrics is not None and self.metrics not in METRICS_FORMATS:
+            raise StudyConversionError(f"metrics must be one of {METRICS_FORMATS}, not '{self.metrics}'")
+        if self.log_level not in LOG_LEVELS:
+            raise StudyConversionError(f"log_level must be one of {LOG_LEVELS}, not '{self.log_level}'")
+        if self.preview is not None and self.preview not in PREVIEW_FORMATS:
+            raise StudyConversionError(f"preview must be one of {PREVIEW_FORMATS}, not '{self.preview}'")
+        if self.preview_rows < 0:
+            raise StudyConversionError("preview_rows must be 0 (all rows) or a positive number of rows.")
+        if self.chunksize is not None and self.chunksize < 1:
+            raise StudyConversionError("chunksize must be a positive number of rows.")
+        return self
+
+
+@dataclass
+class StudyResult:
+    """What convert_study() produced."""
+    study_dir: str
+    files: list = field(default_factory=list)
+    rows: int = 0
+    patient_columns: list = field(default_factory=list)
+    sample_columns: list = field(default_factory=list)
+    malformed_lines: list = field(default_factory=list)
+    seconds: float = 0.0
+    # incremental runs: nothing was done / files left untouched because their content did not change
+    skipped: bool = False
+    unchanged_files: list = field(default_factory=list)
+    chunk_digests: list = field(default_factory=list)
+    changed_chunks: list = field(default_factory=list)
+    # rows dropped because their PATIENT_ID/SAMPLE_ID was already written with other values
+    conflicts: list = field(default_factory=list)
+    # {stage: {seconds, rows, columns, bytes_written, rss_delta_mb, calls}}, see timed_stage()
+    stages: dict = field(default_factory=dict)
+    # Issues found in the written study when config.validate_output is set
+    validation: list = field(default_factory=list)
+
+
+def load_config(path):
+    """Reads a StudyConfig from a json or yaml file."""
+    return StudyConfig.from_dict(_load_json_or_yaml(path))
+
+
+def add_conversion_options(parser):
+    """Options that tune how a conversion runs, shared with the batch runner. None keeps the config value."""
+    parser.add_argument("--chunksize", dest='chunksize', type=int, default=None,
+                        help='Streaming mode: read, clean and write the input this many rows at a time '
+                             'so memory stays flat on very large files (default: off)')
+    parser.add_argument("--workers", dest='workers', type=int, default=None,
+                        help='Number of processes used to clean and type the columns (default: 1)')
+    parser.add_argument("--bad-lines", dest='bad_lines', choices=BAD_LINE_POLICIES, default=None,
+                        help="What to do with csv lines that have more fields than the header: ask, skip them, "
+                             "truncate them to the header (option 1), drop the --drop-columns (option 2) or abort "
+                             "(default: ask when interactive, skip otherwise)")
+    parser.add_argument("--drop-columns", dest='drop_columns', type=str, default=None,
+                        help="Comma separated column indices to drop with --bad-lines drop")
+    parser.add_argument("--duplicate-columns", dest='duplicate_columns', choices=DUPLICATE_COLUMN_POLICIES,
+                        default=None,
+                        help="Which copy of a duplicated column to keep (default: ask when interactive, first otherwise)")
+    parser.add_argument("--output-threads", dest='output_threads', type=int, default=None,
+                        help=f"Number of meta/data files written at the same time (default: {OUTPUT_THREADS})")
+    parser.add_argument("--arrow-strings", dest='arrow_strings', action='store_true', default=None,
+                        help="Keep the text columns as pyarrow backed strings (needs pyarrow): less memory and "
+                             "faster cleaning on large text-heavy files")
+    parser.add_argument("--sheet", dest='sheet', type=str, default=None,
+                        help="Excel sheet to read, by index (0 is the first) or name (default: 0)")
+    parser.add_argument("--no-excel-cache", dest='excel_cache', action='store_false', default=None,
+                        help="Do not keep a parquet copy of the excel sheet next to the workbook")
+    parser.add_argument("--incremental", dest='incremental', action='store_true', default=None,
+                        help="Skip the study if its input and config did not change since the last run and only "
+                             "rewrite the output files whose content changed")
+    parser.add_argument("--gene-panel", dest='gene_panel', type=str, default=None,
+                        help="Write a gene panel matrix with this panel stable id for the gene columns (default: off)")
+    parser.add_argument("--gene-list", dest='gene_list', type=str, default=None,
+                        help="File with the HUGO symbols whose columns are gene columns, one per line "
+                             "(default: a built-in colorectal list)")
+    parser.add_argument("--gene-columns", dest='gene_columns', type=str, default=None,
+                        help="Comma separated gene columns, instead of looking them up in the gene list")
+    parser.add_argument("--synonyms", dest='synonyms', type=str, default=None,
+                        help="json/yaml file with more column aliases and the id normalization rules, "
+                             "shared by the studies (see the README)")
+    parser.add_argument("--vocabulary-cache", dest='vocabulary_cache', type=str, default=None,
+                        help="json file that keeps the normalized values of the categorical columns between runs, "
+                             "it can be shared by all studies (default: none)")
+    parser.add_argument("--validate", dest='validate_output', action='store_true', default=None,
+                        help="Check the written meta, data and case list files like the importer would")
+    parser.add_argument("--metrics", dest='metrics', choices=METRICS_FORMATS, default=None,
+                        help="Write the time, rows, columns, bytes and memory of every stage to "
+                             "conversion_metrics.jsonl / conversion_metrics.prom in the study directory")
+    parser.add_argument("--profile", dest='profile', type=str, default=None,
+                        help="Profile the conversion into this file: .prof (cProfile) or .html (needs pyinstrument)")
+    parser.add_argument("--log-level", dest='log_level', choices=LOG_LEVELS, default=None,
+                        help="debug also logs the per-column messages (default: info)")
+    parser.add_argument("--preview", dest='preview', choices=PREVIEW_FORMATS, default=None,
+                        help="Write the first cleaned rows to preview_cleaned.<format> in the study directory "
+                             "(default: no preview)")
+    parser.add_argument("--preview-rows", dest='preview_rows', type=int, default=None,
+                        help=f"Number of rows in the preview, 0 for all of them (default: {PREVIEW_ROWS})")
+    parser.add_argument("--irrelevant-columns", dest='irrelevant_columns', type=str, default=None,
+                        help="Comma separated columns left out of the sample data")
+    parser.add_argument("--patient-columns", dest='patient_columns', type=str, default=None,
+                        help="Comma separated patient columns")
+    parser.add_argument("--sample-columns", dest='sample_columns', type=str, default=None,
+                        help="Comma separated sample columns (default: all columns that are not patient columns)")
+    return parser
+
+
+CONVERSION_OPTIONS = ['chunksize', 'workers', 'output_threads', 'bad_lines', 'drop_columns', 'duplicate_columns',
+                      'irrelevant_columns', 'patient_columns', 'sample_columns', 'incremental', 'sheet', 'excel_cache',
+                      'preview', 'preview_rows', 'arrow_strings', 'gene_panel', 'gene_list', 'gene_columns',
+                      'synonyms', 'vocabulary_cache', 'validate_output', 'metrics', 'profile', 'log_level']
+
+
+def conversion_settings(options):
+    """The StudyConfig values given on the command line."""
+    return {key: getattr(options, key) for key in CONVERSION_OPTIONS if getattr(options, key) is not None}
+
+
+def parse_options(argv=None):
+    """
+    Command line of the parser. Without -f/--config the study is prompted for, as before;
+    with them the conversion runs unattended through convert_study().
+    """
+    parser = argparse.ArgumentParser(description="Convert a clinical csv/excel file into a cBioPortal study.")
+    parser.add_argument("--config", dest='config', type=str, default=None,
+                        help='json/yaml file with the StudyConfig of the study, command line values override it')
+    parser.add_argument("-f", "--file", dest='file', type=str, default=None,
+                        help='csv, xlsx, parquet or feather file with the clinical data')
+    parser.add_argument("-n", '--study-name', dest='study_name', type=str, default=None, help='Name of the study')
+    parser.add_argument("-ct", '--cancer-type', dest='cancer_type', type=str, default=None, help='Cancer type')
+    parser.add_argument("-csi", "--cancer-study-identifier", dest='cancer_study_identifier', type=str, default=None,
+                        help='Cancer_study_identifier')
+    parser.add_argument("-d", "--description", dest='description', type=str, default=None,
+                        help='Description of the study')
+    parser.add_argument("-gat", '--genetic-alteration-type', dest='genetic_alteration_type', type=str, default=None,
+                        help='genetic-alteration-type')
+    parser.add_argument("-wd", '--work-dir', dest='work_dir', type=str, default=None,
+                        help='target_dir for study creation')
+    parser.add_argument("--dry-run", dest='dry_run', action='store_true',
+                        help="Only check the config and the header of the input file, nothing is written")
+    add_conversion_options(parser)
+    return parser.parse_args(argv)
+
+
+def config_from_options(options):
+    """StudyConfig of an unattended run: the --config file, overridden by the command line values."""
+    values = {}
+    if options.config:
+        values = {f.name: getattr(c, f.name) for c in [load_config(options.config)] for f in fields(c)}
+    for key in ['file', 'study_name', 'cancer_type', 'cancer_study_identifier', 'description',
+                'genetic_alteration_type', 'work_dir']:
+        if getattr(options, key) is not None:
+            values[key] = getattr(options, key)
+    values.update(conversion_settings(options))
+    return StudyConfig.from_dict(values)
+
+
+def config_from_prompts(args, options):
+    """StudyConfig of an interactive run, the study comes from parse_arguments()."""
+    values = {
+        'file': args['f'],
+        'study_name': args['n'],
+        'cancer_type': args['ct'],
+        'cancer_study_identifier': args['csi'],
+        'description': args['d'],
+        'genetic_alteration_type': args['gat'],
+        'work_dir': args['wd'],
+        'bad_lines': 'ask',
+        'duplicate_columns': 'ask',
+        'interactive': True,
+    }
+    values.update(conversion_settings(options))
+    return StudyConfig.from_dict(values)
     
 
-def read_input_file(file_path):
+BAD_LINE_POLICIES = ['ask', 'skip', 'truncate', 'drop', 'abort']
+BAD_LINE_PATTERN = re.compile(r"line (\d+): expected (\d+) fields, saw (\d+)")
+
+
+def _csv_header(file_path):
+    """Column names of a csv file, only the first line is parsed."""
+    return list(pd.read_csv(file_path, quotechar='"', nrows=0).columns)
+
+
+def _keep_column_indices(file_path, bad_lines, drop_columns):
+    """
+    usecols for the 'truncate' and 'drop' policies. Both are applied by the C parser while it reads,
+    malformed lines simply lose their extra fields.
+    """
+    header = _csv_header(file_path)
+    if bad_lines == 'truncate':
+        return list(range(len(header)))
+    if drop_columns is None:
+        print("\nCurrent columns with indices:")
+        for i, col in enumerate(header):
+            print(f"{i}: {col}")
+        while True:
+            cols_to_drop = input("\nEnter column indices to DROP (comma-separated): ").strip()
+            try:
+                drop_columns = [int(x.strip()) for x in cols_to_drop.split(',') if x.strip()]
+                break
+            except ValueError:
+                print("Invalid column indices. Please try again.")
+    return [i for i in range(len(header)) if i not in drop_columns]
+
+
+def _collect_bad_lines(caught, bad_lines):
+    """Moves the 'Skipping line N' parser warnings into bad_lines as (line, expected, saw) tuples."""
+    for w in caught:
+        matches = BAD_LINE_PATTERN.findall(str(w.message))
+        if matches:
+            bad_lines.extend(tuple(int(x) for x in m) for m in matches)
+        else:
+            warnings.warn_explicit(w.message, w.category, w.filename, w.lineno)
+
+
+def _read_csv_fast(file_path, bad_lines, **kwargs):
+    """
+    Reads a csv with the C engine. Lines with too many fields are skipped and their
+    line numbers appended to bad_lines, no second copy of the file is ever made.
+    """
+    # index_col=False stops pandas from turning the first column into the index when the
+    # first data line happens to have one field too many
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", pd.errors.ParserWarning)
+        df = pd.read_csv(file_path, quotechar='"', engine='c', on_bad_lines='warn', index_col=False, **kwargs)
+    _collect_bad_lines(caught, bad_lines)
+    return df
+
+
+def report_bad_lines(bad_lines, limit=20):
+    """Prints the malformed line numbers found while reading."""
+    print(f"\nCSV Parsing Error: {len(bad_lines)} malformed line(s) were found.")
+    for line_num, expected, saw in bad_lines[:limit]:
+        print(f"  Expected {expected} fields in line {line_num}, saw {saw}")
+    if len(bad_lines) > limit:
+        print(f"  ... and {len(bad_lines) - limit} more")
+    print("This is usually caused by unescaped commas in quoted fields.")
+
+
+EXCEL_CHUNK_ROWS = 50000
+
+
+def _excel_sheet_label(sheet):
+    return re.sub(r"[^\w.-]+", "_", str(sheet))
+
+
+def excel_cache_path(file_path, sheet=0):
+    """Parquet copy of a workbook sheet, kept next to the workbook. sheet is a name, see excel_sheet_name()."""
+    return f"{file_path}.{_excel_sheet_label(sheet)}.parquet"
+
+
+def _excel_source_stamp(file_path, sheet):
+    stat = os.stat(file_path)
+    return json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sheet': sheet}).encode()
+
+
+def _fresh_excel_cache(file_path, sheet):
+    """Path of an up to date parquet copy of the sheet, None if there is none (or no pyarrow)."""
+    cache = excel_cache_path(file_path, sheet)
+    if not exists(cache):
+        return None
     try:
-        if file_path.endswith(".xlsx"):
-            return pd.read_excel(file_path, sheet_name=0)
+        import pyarrow.parquet as pq
+        metadata = pq.read_schema(cache).metadata or {}
+    except Exception:
+        return None
+    if metadata.get(b'cbioportal_source') != _excel_source_stamp(file_path, sheet):
+        return None
+    return cache
+
+
+def _excel_header(row):
+    """Column names like pandas gives them: empty cells become 'Unnamed: i', repeats get .1, .2, ..."""
+    names, seen = [], Counter()
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None or value == '' else str(value)
+        if seen[name]:
+            name = f"{name}.{seen[name]}"
+        seen[str(value) if value not in (None, '') else name] += 1
+        names.append(name)
+    return names
+
+
+def _workbook_sheet(file_path, sheet, names):
+    """
+    The sheet as an index or one of the names of the workbook: a digit string like '2' (from --sheet or a
+    csv manifest) is the sheet of that name when the workbook has one, the sheet at that index otherwise.
+    """
+    if isinstance(sheet, str) and sheet not in names and sheet.strip().isdigit():
+        sheet = int(sheet)
+    if sheet not in (range(len(names)) if isinstance(sheet, int) else names):
+        raise StudyConversionError(f"Error: Sheet {sheet} was not found in {file_path}, the sheets are {names}")
+    return sheet
+
+
+def _excel_sheet_names(file_path):
+    """Names of the sheets of a workbook in order, from xl/workbook.xml alone (no sheet is parsed)."""
+    import zipfile
+    from xml.etree import ElementTree
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            root = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        return [element.get('name') for element in root.iter() if element.tag.rpartition('}')[2] == 'sheet']
+    except (KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+
+
+def excel_sheet_name(file_path, sheet):
+    """
+    The name of the sheet an index or name stands for: 0, "0" and the name of the first sheet are
+    the same sheet, and one parquet copy of it (see _workbook_sheet() for digit names).
+    """
+    names = _excel_sheet_names(file_path)
+    sheet = _workbook_sheet(file_path, sheet, names)
+    return names[sheet] if isinstance(sheet, int) else sheet
+
+
+def _excel_rows(file_path, sheet):
+    """
+    Rows of a sheet as tuples without building the workbook object model: python-calamine
+    when it is installed, openpyxl in read-only mode otherwise.
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        CalamineWorkbook = None
+
+    if CalamineWorkbook is not None:
+        workbook = CalamineWorkbook.from_path(file_path)
+        sheet = _workbook_sheet(file_path, sheet, workbook.sheet_names)
+        if isinstance(sheet, int):
+            worksheet = workbook.get_sheet_by_index(sheet)
         else:
-            # First try reading normally with proper CSV handling
+            worksheet = workbook.get_sheet_by_name(sheet)
+        for row in worksheet.iter_rows():
+            # calamine gives '' for empty cells and floats for whole numbers
+            yield tuple(None if v == '' else int(v) if type(v) is float and v.is_integer() else v
+                        for v in row)
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = _workbook_sheet(file_path, sheet, workbook.sheetnames)
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _cache_columns(cached, usecols):
+    """Names of the usecols positions in the parquet copy of a sheet, None for all of them."""
+    if usecols is None:
+        return None
+    import pyarrow.parquet as pq
+    names = pq.read_schema(cached).names
+    return [names[i] for i in usecols]
+
+
+def iter_excel_chunks(file_path, chunksize=None, sheet=0, cache=True, usecols=None):
+    """
+    Yields a sheet of a workbook as DataFrames of at most chunksize rows, streaming the rows.
+    The first run also writes a parquet copy of the sheet next to the workbook (needs pyarrow),
+    later runs read that copy instead of parsing the workbook again.
+    usecols keeps only these column positions in the chunks, the copy always has the whole sheet.
+    """
+    chunksize = chunksize or EXCEL_CHUNK_ROWS
+    sheet = excel_sheet_name(file_path, sheet)
+    cached = _fresh_excel_cache(file_path, sheet) if cache else None
+    if cached:
+        import pyarrow.parquet as pq
+        print(f"Reading the parquet copy of the workbook: {cached}")
+        columns = _cache_columns(cached, usecols)
+        for batch in pq.ParquetFile(cached).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    writer = None
+    if cache:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            cache = False
+    cache_file = excel_cache_path(file_path, sheet)
+    partial = cache_file + ".partial"
+
+    rows = _excel_rows(file_path, sheet)
+    header = _excel_header(next(rows, ()))
+    width = len(header)
+    try:
+        while True:
+            block = list(itertools.islice(rows, chunksize))
+            if not block:
+                break
+            chunk = pd.DataFrame.from_records([r[:width] for r in block], columns=header)
+            if cache:
+                try:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        schema = table.schema.with_metadata(
+                            {'cbioportal_source': _excel_source_stamp(file_path, sheet)})
+                        writer = pq.ParquetWriter(partial, schema)
+                    writer.write_table(table.cast(writer.schema))
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OSError) as e:
+                    # mixed types in a column, read-only directory, ...: go on without a copy
+                    print(f"Note: no parquet copy of the workbook is written ({e}).")
+                    cache = False
+            yield chunk if usecols is None else chunk.iloc[:, usecols]
+        if writer is not None and cache:
+            writer.close()
+            writer = None
+            os.replace(partial, cache_file)
+    finally:
+        if writer is not None:
+            writer.close()
+        if exists(partial):
+            os.remove(partial)
+
+
+def read_excel_file(file_path, sheet=0, cache=True, usecols=None):
+    """A whole sheet as one DataFrame, through the streaming reader or its parquet copy."""
+    sheet = excel_sheet_name(file_path, sheet)
+    cached = _fresh_excel_cache(file_path, sheet) if cache else None
+    if cached:
+        print(f"Reading the parquet copy of the workbook: {cached}")
+        return pd.read_parquet(cached, columns=_cache_columns(cached, usecols))
+    chunks = list(iter_excel_chunks(file_path, sheet=sheet, cache=cache, usecols=usecols))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather',
+                    '.ipc': 'feather'}
+
+
+def _columnar_dataset(file_path):
+    """pyarrow dataset of a parquet or Arrow IPC (feather) file, None for other files."""
+    fmt = COLUMNAR_FORMATS.get(os.path.splitext(file_path)[1].lower())
+    if fmt is None:
+        return None
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise StudyConversionError(f"Reading {file_path} needs pyarrow (uv pip install pyarrow).")
+    if not exists(file_path):
+        raise FileNotFoundError(file_path)
+    return ds.dataset(file_path, format=fmt)
+
+
+def _dataset_columns(dataset, usecols):
+    """Names of the usecols positions of a dataset, None for all of them."""
+    if usecols is None:
+        return None
+    return [dataset.schema.names[i] for i in usecols]
+
+
+def iter_columnar_chunks(dataset, chunksize, usecols=None):
+    """Record batches of at most chunksize rows of a parquet/feather dataset, as DataFrames."""
+    for batch in dataset.to_batches(batch_size=chunksize, columns=_dataset_columns(dataset, usecols)):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def to_arrow_strings(df):
+    """
+    Text columns of df as pyarrow backed strings (in place): a fraction of the memory of python
+    string objects, and clean_dataframe() uses the vectorised arrow string kernels on them.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise StudyConversionError("arrow_strings needs pyarrow (uv pip install pyarrow).")
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow":
+            continue
+        if dtype == "object" or isinstance(dtype, pd.StringDtype):
+            col = df.iloc[:, i]
             try:
-                return pd.read_csv(file_path, quotechar='"', engine='python')
-            except pd.errors.ParserError as e:
-                if "Expected" in str(e) and "saw" in str(e):
-                    # Extract the exact error details
-                    error_msg = str(e)
-                    expected = error_msg.split("Expected ")[1].split(" ")[0]
-                    saw = error_msg.split("saw ")[1].split(" ")[0]
-                    line_num = error_msg.split("line ")[1].split(",")[0]
-                    
-                    print(f"\nCSV Parsing Error: Expected {expected} fields in line {line_num}, saw {saw}")
-                    print("This is usually caused by unescaped commas in quoted fields.")
-                    
-                    # Read the file content to show columns
-                    with open(file_path, 'r') as f:
-                        content = f.read()
-                    reader = csv.reader(StringIO(content), quotechar='"')
-                    rows = list(reader)
-                    
-                    # Offer solutions
-                    while True:
-                        print("\nHow would you like to proceed?")
-                        print("1. Fix automatically (keep first N columns)")
-                        print("2. Specify columns to drop")
-                        print("3. Abort")
-                        choice = input("Enter choice (1-3): ").strip()
-                        
-                        if choice == '1':
-                            # Read keeping only the expected number of columns
-                            return pd.read_csv(file_path, usecols=range(int(expected)), quotechar='"')
-                            
-                        elif choice == '2':
-                            print("\nCurrent columns with indices:")
-                            for i, col in enumerate(rows[0]):
-                                print(f"{i}: {col}")
-                            
-                            cols_to_drop = input("\nEnter column indices to DROP (comma-separated): ").strip()
-                            try:
-                                drop_indices = [int(x.strip()) for x in cols_to_drop.split(',') if x.strip()]
-                                keep_indices = [i for i in range(len(rows[0])) if i not in drop_indices]
-                                
-                                # Process all rows keeping only specified columns
-                                processed_rows = []
-                                for row in rows:
-                                    try:
-                                        processed_rows.append([row[i] for i in keep_indices])
-                                    except IndexError:
-                                        continue  # Skip rows that don't have all columns
-                                
-                                df = pd.DataFrame(processed_rows[1:], columns=processed_rows[0])
-                                print(f"\nKept {len(processed_rows)} rows with {len(keep_indices)} columns.")
-                                return df
-                            except (ValueError, IndexError) as e:
-                                print("Invalid column indices. Please try again.")
-                                continue
-                                
-                        elif choice == '3':
-                            exit(0)
-                        else:
-                            print("Invalid choice")
-                
-                # Re-raise if it's a different parser error
-                raise
+                df.isetitem(i, col.astype(pd.StringDtype("pyarrow")))
+            except (TypeError, ValueError):
+                # not text after all (bytes, nested values, ...)
+                pass
+    return df
+
+
+def _csv_usecols(file_path, bad_lines, drop_columns, usecols):
+    """
+    The usecols of the 'truncate'/'drop' policies, narrowed to the usecols positions of read_plan().
+    """
+    keep = _keep_column_indices(file_path, bad_lines, drop_columns)
+    if usecols is None:
+        return keep
+    planned = set(usecols)
+    return [i for i in keep if i in planned]
+
+
+def read_input_file(file_path, bad_lines='ask', drop_columns=None, malformed_lines=None, sheet=0, excel_cache=True,
+                    usecols=None, dtype=None):
+    """
+    Reads the clinical excel/csv/parquet/feather file (sheet picks the excel sheet by index or name).
+    bad_lines decides what happens to csv lines with too many fields: 'ask' the user, 'skip' them,
+    'truncate' them to the header width (option 1), 'drop' the drop_columns indices (option 2) or 'abort'.
+    The malformed lines found are added to the malformed_lines list if one is given.
+    usecols and dtype (see read_plan()) limit the read to these column positions and set csv column types.
+    """
+    try:
+        dataset = _columnar_dataset(file_path)
+        if dataset is not None:
+            table = dataset.to_table(columns=_dataset_columns(dataset, usecols))
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        if file_path.endswith(".xlsx"):
+            return read_excel_file(file_path, sheet, excel_cache, usecols)
+        else:
+            if bad_lines in ('truncate', 'drop'):
+                usecols = _csv_usecols(file_path, bad_lines, drop_columns, usecols)
+                return pd.read_csv(file_path, quotechar='"', engine='c', usecols=usecols, dtype=dtype)
+
+            found = [] if malformed_lines is None else malformed_lines
+            # usecols would stop the C parser from noticing lines with too many fields,
+            # so the other columns are parsed here and dropped right away
+            df = _read_csv_fast(file_path, found, dtype=dtype)
+            if usecols is not None:
+                df = df.iloc[:, usecols]
+            if not found or bad_lines == 'skip':
+                if found:
+                    print(f"Skipped {len(found)} malformed line(s): {[line for line, _, _ in found]}")
+                return df
+
+            report_bad_lines(found)
+            if bad_lines == 'abort':
+                raise StudyConversionError(f"Aborted: {len(found)} malformed line(s) in {file_path}")
+
+            # Offer solutions
+            while True:
+                print("\nHow would you like to proceed?")
+                print("1. Fix automatically (keep first N columns)")
+                print("2. Specify columns to drop")
+                print("3. Abort")
+                print("4. Skip the malformed lines")
+                choice = input("Enter choice (1-4): ").strip()
+
+                if choice == '1':
+                    # Read keeping only the expected number of columns
+                    return read_input_file(file_path, bad_lines='truncate', drop_columns=drop_columns,
+                                           usecols=usecols, dtype=dtype)
+                elif choice == '2':
+                    df = read_input_file(file_path, bad_lines='drop', drop_columns=drop_columns, usecols=usecols,
+                                         dtype=dtype)
+                    print(f"\nKept {len(df)} rows with {len(df.columns)} columns.")
+                    return df
+                elif choice == '3':
+                    exit(0)
+                elif choice == '4':
+                    return df
+                else:
+                    print("Invalid choice")
                 
+    except StudyConversionError:
+        raise
     except PermissionError as e:
-        print(f"Error: Permission denied while trying to read the file: {file_path}")
-        exit(1)
+        raise StudyConversionError(f"Error: Permission denied while trying to read the file: {file_path}")
     except FileNotFoundError as e:
-        print(f"Error: The file {file_path} was not found.")
-        exit(1)
+        raise StudyConversionError(f"Error: The file {file_path} was not found.")
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        exit(1)
+        raise StudyConversionError(f"An unexpected error occurred: {e}") from e
+
+def iter_input_chunks(file_path, chunksize, bad_lines='ask', drop_columns=None, malformed_lines=None, sheet=0,
+                      excel_cache=True, usecols=None, dtype=None):
+    """
+    Yields the input file as DataFrames of at most `chunksize` rows.
+    Malformed csv lines are handled while streaming: 'truncate' and 'drop' repair them on the fly,
+    otherwise they are skipped and reported ('abort' stops at the first one).
+    usecols and dtype work as in read_input_file().
+    """
+    try:
+        dataset = _columnar_dataset(file_path)
+        if dataset is not None:
+            yield from iter_columnar_chunks(dataset, chunksize, usecols)
+            return
+        if file_path.endswith(".xlsx"):
+            yield from iter_excel_chunks(file_path, chunksize, sheet, excel_cache, usecols)
+            return
+
+        if bad_lines in ('truncate', 'drop'):
+            usecols = _csv_usecols(file_path, bad_lines, drop_columns, usecols)
+            yield from pd.read_csv(file_path, quotechar='"', engine='c', usecols=usecols, dtype=dtype,
+                                   chunksize=chunksize)
+            return
+
+        # Note: the C parser does not check the first line of each chunk, a malformed line that
+        # starts a chunk is truncated to the header width (as with 'truncate') instead of skipped
+        found = [] if malformed_lines is None else malformed_lines
+        reader = pd.read_csv(file_path, quotechar='"', engine='c', on_bad_lines='warn', index_col=False,
+                             dtype=dtype, chunksize=chunksize)
+        with reader:
+            while True:
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always", pd.errors.ParserWarning)
+                    chunk = next(reader, None)
+                n_found = len(found)
+                _collect_bad_lines(caught, found)
+                if len(found) > n_found and bad_lines == 'abort':
+                    report_bad_lines(found)
+                    raise StudyConversionError(f"Aborted: malformed line(s) in {file_path}")
+                if chunk is None:
+                    break
+                yield chunk if usecols is None else chunk.iloc[:, usecols]
+        if found:
+            report_bad_lines(found)
+            print("These lines were skipped. Use --bad-lines truncate or --bad-lines drop to keep them.")
+    except PermissionError as e:
+        raise StudyConversionError(f"Error: Permission denied while trying to read the file: {file_path}")
+    except FileNotFoundError as e:
+        raise StudyConversionError(f"Error: The file {file_path} was not found.")
+
+NA_STRINGS = frozenset(["n.a.", "n.a"])
+NEWLINE_PATTERN = re.compile(r"\r\n|\r|\n")
+
+
+def _clean_text(value):
+    """NA normalisation, newline collapsing and stripping of a single cell."""
+    if type(value) is not str:
+        return value
+    if value in NA_STRINGS:
+        return np.nan
+    if "\r" in value:
+        value = value.replace("\r\n", " ").replace("\r", " ")
+    if "\n" in value:
+        value = value.replace("\n", " ")
+    return value.strip()
+
+
+# normalized text values kept in the Vocabulary, and the distinct values a column may have to use it
+VOCABULARY_SIZE = 100000
+VOCABULARY_COLUMN_VALUES = 1000
+
+
+class Vocabulary:
+    """
+    LRU table of normalized text values per normalization ('clean', 'status', 'boolean'): the values
+    of the low-cardinality columns (SEX, TUMOR_SITE, the statuses, yes/no) are normalized once and
+    then looked up, across the chunks of a stream and the studies of a batch worker.
+    load()/save() keep it in a json file between runs. The file is tied to the parser it was
+    written by, another version of the parser starts with an empty vocabulary.
+    """
+
+    def __init__(self, max_entries=VOCABULARY_SIZE):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        # the files of a study are written on several threads, see OutputQueue
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def normalize(self, kind, func, values):
+        """func(value) of every distinct value in values, the text values through the vocabulary."""
+        if len(values) > VOCABULARY_COLUMN_VALUES:
+            # ids and free text would only push the useful entries out
+            return [func(value) for value in values]
+        with self.lock:
+            return self._normalize(kind, func, values)
+
+    def _normalize(self, kind, func, values):
+        entries = self.entries
+        results = []
+        for value in values:
+            if type(value) is not str:
+                results.append(func(value))
+                continue
+            key = (kind, value)
+            if key in entries:
+                entries.move_to_end(key)
+                self.hits += 1
+                results.append(entries[key])
+            else:
+                results.append(entries.setdefault(key, func(value)))
+                self.misses += 1
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        return results
+
+    def load(self, path):
+        """Adds the entries of a vocabulary file, a missing, broken or outdated file is ignored."""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return self
+        if saved.get('parser') != _parser_digest():
+            return self
+        for kind, raw, value in saved.get('entries', [])[-self.max_entries:]:
+            self.entries[(kind, raw)] = np.nan if value is None else value
+        return self
+
+    def save(self, path):
+        """Writes the vocabulary to path (least recently used first), replacing the file at once."""
+        entries = [[kind, raw, value if isinstance(value, str) else None]
+                   for (kind, raw), value in self.entries.items()]
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=directory, suffix=".partial")
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'parser': _parser_digest(), 'entries': entries}, f)
+        os.replace(partial, path)
 
-def clean_dataframe(df):
-    df = df.replace("n.a.", np.nan).replace("n.a", np.nan)
-    df = df.replace({"\r\n": "\n", "\r": '\n'}, regex=True)  
-    df = df.replace({"\n": " "}, regex=True)
+
+VOCABULARY = Vocabulary()
+
+
+def _parser_digest():
+    return file_digest(os.path.abspath(__file__))['sha256']
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pauses the cyclic garbage collector. Object columns are tracked containers, so building
+    many new ones triggers full collections that walk every cell of the frame again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _clean_column(col):
+    """Cleaned values of a text column, None for columns that are left as they are."""
+    if not (isinstance(col.dtype, pd.StringDtype) or col.dtype == "object"):
+        return None
+    # the first rows tell ids and free text apart from categories without factorizing all of them
+    head = col.iloc[:VOCABULARY_COLUMN_VALUES]
+    if head.nunique() * 2 <= len(head):
+        positions, uniques = col.factorize()
+        # factorize() would merge 1 and True of a mixed object column, those are cleaned cell by cell
+        if len(uniques) * 2 <= len(col) and (col.dtype != "object" or all(type(u) is str for u in uniques)):
+            # each distinct value is cleaned once and taken back to the rows, -1 (missing) is the last
+            cleaned = VOCABULARY.normalize('clean', _clean_text, list(uniques)) + [np.nan]
+            if col.dtype == "object":
+                values = np.empty(len(cleaned), dtype=object)
+                values[:] = cleaned
+                return values[positions]
+            return pd.array(cleaned, dtype=col.dtype).take(positions)
+    if isinstance(col.dtype, pd.StringDtype) and col.dtype.storage == "pyarrow":
+        # arrow backed columns have vectorised string kernels
+        col = col.mask(col.isin(NA_STRINGS))
+        return col.str.replace(NEWLINE_PATTERN.pattern, " ", regex=True).str.strip().array
+    if isinstance(col.dtype, pd.StringDtype) or col.dtype == "object":
+        values = col.to_numpy(dtype=object)
+        cleaned = np.empty(len(values), dtype=object)
+        cleaned[:] = [_clean_text(v) for v in values]
+        if col.dtype != "object":
+            return pd.array(cleaned, dtype=col.dtype)
+        return cleaned
+    return None
+
+
+# Frame handed to forked pool workers. They inherit it from the parent process,
+# so the columns are never pickled on the way in.
+_POOL_FRAME = None
+
+
+def _pack_column_results(results):
+    """
+    Moves the array results of a worker into one Arrow IPC buffer in shared memory.
+    Returns (shared memory name, size, results that could not be stored as Arrow columns).
+    """
+    try:
+        import pyarrow as pa
+        from multiprocessing import shared_memory, resource_tracker
+    except ImportError:
+        return None, 0, results
+    arrays, rest = {}, {}
+    for pos, value in results.items():
+        if isinstance(value, (np.ndarray, pd.api.extensions.ExtensionArray)):
+            try:
+                arrays[str(pos)] = pa.array(value, from_pandas=True)
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        rest[pos] = value
+    if not arrays:
+        return None, 0, rest
+    table = pa.table(arrays)
+    # size the block first, then serialise straight into shared memory
+    mock = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock, table.schema) as writer:
+        writer.write_table(table)
+    size = mock.size()
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    target = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+    with pa.ipc.new_stream(target, table.schema) as writer:
+        writer.write_table(table)
+    target.close()
+    del target, writer
+    # the parent unlinks the block once it has read it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return shm.name, size, rest
+
+
+def _unpack_column_results(packed):
+    name, size, results = packed
+    if name is None:
+        return results
+    import pyarrow as pa
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # one memcpy out of the block so the columns do not outlive the shared memory
+        with shm.buf[:size] as view:
+            data = pa.py_buffer(bytes(view))
+    finally:
+        shm.close()
+        shm.unlink()
+    table = pa.ipc.open_stream(data).read_all()
+    for column_name in table.column_names:
+        results[int(column_name)] = table.column(column_name).to_pandas().array
+    return results
+
+
+def _column_job(func, positions):
+    df = _POOL_FRAME
+    with gc_paused():
+        results = {i: func(df.iloc[:, i]) for i in positions}
+    return _pack_column_results(results)
+
+
+def map_columns(df, func, workers=1):
+    """
+    func(column) for every column of df, in column order.
+    With workers > 1 the columns are split over a process pool. The workers are forked and
+    inherit df, and array results come back as Arrow buffers in shared memory when pyarrow
+    is installed (otherwise they are pickled). func has to be a module level function.
+    """
+    if workers is None or workers <= 1 or df.shape[1] < 2 or "fork" not in mp.get_all_start_methods():
+        with gc_paused():
+            return [func(df.iloc[:, i]) for i in range(df.shape[1])]
+
+    global _POOL_FRAME
+    _POOL_FRAME = df
+    results = {}
+    try:
+        # a few blocks per worker so one slow (wide text) block does not hold up the rest
+        blocks = [b.tolist() for b in np.array_split(np.arange(df.shape[1]), workers * 4) if len(b)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("fork")) as pool:
+            for packed in pool.map(_column_job, [func] * len(blocks), blocks):
+                results.update(_unpack_column_results(packed))
+    finally:
+        _POOL_FRAME = None
+    return [results[i] for i in range(df.shape[1])]
+
+
+def clean_dataframe(df, drop_empty_columns=True, workers=1):
+    """
+    Cleans df in place, one pass per text column: "n.a."/"n.a" become NaN, line breaks
+    become a space and the values are stripped. Numeric columns are left untouched.
+    workers > 1 spreads the columns over a process pool.
+    """
+    for i, cleaned in enumerate(map_columns(df, _clean_column, workers)):
+        if cleaned is not None:
+            df.isetitem(i, cleaned)
     df.columns = df.columns.str.strip().str.replace(' ', '_')  
-    df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)  
     df = df.dropna(how='all')  
-    df = df.dropna(axis=1, how='all')  
+    # In streaming mode a column can be empty in one chunk and filled in the next,
+    # so the column set has to stay fixed across chunks
+    if drop_empty_columns:
+        df = df.dropna(axis=1, how='all')  
     return df
 
-def handle_duplicate_columns(df):
+def handle_duplicate_columns(df, policy='ask'):
     """
     Handles duplicate columns by asking user which ones to keep.
     Returns dataframe with unique column names.
     """
+    return df.loc[:, duplicate_column_mask(df, policy)]
+
+def duplicate_column_mask(df, policy='ask'):
+    """
+    Asks the user which of the duplicate columns to keep.
+    Returns a boolean mask over df.columns, so the same choice can be applied to later chunks.
+    policy 'first'/'last' keeps that occurrence of each duplicate without asking, 'abort' fails.
+    """
+    keep_mask = np.ones(len(df.columns), dtype=bool)
     while True:
         # Find duplicate columns
         duplicates = df.columns[df.columns.duplicated()].unique()
         
         if len(duplicates) == 0:
-            return df
+            return keep_mask
+
+        if policy in ('first', 'last'):
+            print(f"WARNING: Found duplicate column names {list(duplicates)}, keeping the {policy} occurrence.")
+            return ~df.columns.duplicated(keep=policy)
+        if policy == 'abort':
+            raise StudyConversionError(f"Duplicate column names in the data: {list(duplicates)}")
             
         print("\nWARNING: Found duplicate column names in the data:")
         for dup in duplicates:
@@ -146,9 +1160,9 @@ def handle_duplicate_columns(df):
         
         if choice == '1':
             # Keep first occurrence automatically
-            df = df.loc[:, ~df.columns.duplicated(keep='first')]
+            keep_mask = ~df.columns.duplicated(keep='first')
             print("Kept first occurrence of each duplicate column.")
-            return df
+            return keep_mask
             
         elif choice == '2':
             # Let user choose which columns to keep
@@ -166,45 +1180,137 @@ def handle_duplicate_columns(df):
                             continue
                             
                         # Drop all other duplicates of this column
-                        drop_cols = [i for i in indices if i != keep]
-                        df.drop(df.columns[drop_cols], axis=1, inplace=True)
+                        for i in indices:
+                            if i != keep:
+                                keep_mask[i] = False
                         break
                     except ValueError:
                         print("Please enter a valid number")
             
-            return df
+            return keep_mask
             
         elif choice == '3':
             exit(0)
         else:
             print("Invalid choice, please try again")
 
-def rename_columns(df):
+# header alias -> column name, extended with the columns of a synonyms file (see RenameRules.from_file())
+RENAME_MAP = {
+    'PATIENT': 'PATIENT_ID',
+    'DSE_E': 'DFS_STATUS',
+    'DFS_months': 'DFS_MONTHS',
+    'death_event': 'OS_STATUS',
+    'GENDER': 'SEX',
+    'DFS_STATUS_': 'DFS_STATUS',
+}
+ID_COLUMNS = ('PATIENT_ID', 'SAMPLE_ID')
+
+
+def _column_key(name):
+    """A column name as clean_dataframe() and rename_columns() leave it, before the renames."""
+    return str(name).strip().replace(' ', '_').upper()
+
+
+def _load_json_or_yaml(path):
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise StudyConversionError(f"Reading {path} needs PyYAML (uv pip install pyyaml), or use json.")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+class RenameRules:
+    """
+    Header aliases and id normalization, compiled once into a lookup table. Aliases are looked up
+    by _column_key(), so 'death_event', 'Death Event' and 'DEATH_EVENT' are the same alias.
+    id_rules are (regex, replacement) pairs applied in order to the PATIENT_ID/SAMPLE_ID values.
+    """
+
+    def __init__(self, aliases=None, id_rules=()):
+        aliases = RENAME_MAP if aliases is None else aliases
+        self.lookup = {_column_key(alias): name for alias, name in aliases.items()}
+        self.id_rules = [(re.compile(pattern), replacement) for pattern, replacement in id_rules]
+
+    @classmethod
+    def from_file(cls, path, id_rules=()):
+        """
+        RENAME_MAP extended with a synonyms file shared by the studies, json or yaml:
+        {"columns": {"PATIENT_ID": ["Patient Nr", "patient"]}, "ids": [[" ", "_"], ["^0+", ""]]}
+        The "ids" rules run after the given id_rules.
+        """
+        try:
+            values = _load_json_or_yaml(path)
+        except (OSError, ValueError) as e:
+            raise StudyConversionError(f"Cannot read the synonyms file {path}: {e}")
+        columns, ids = values.get('columns') or {}, values.get('ids') or []
+        if not isinstance(columns, dict) or not isinstance(ids, list) \
+                or not all(isinstance(rule, list) and len(rule) == 2 for rule in ids):
+            raise StudyConversionError(f"{path} must have 'columns' {{column: [aliases]}} and 'ids' "
+                                       f"[[regex, replacement], ...].")
+        aliases = dict(RENAME_MAP)
+        for name, names in columns.items():
+            for alias in (names if isinstance(names, list) else [names]):
+                aliases[str(alias)] = str(name)
+        try:
+            return cls(aliases, list(id_rules) + [(str(p), str(r)) for p, r in ids])
+        except re.error as e:
+            raise StudyConversionError(f"Invalid id rule in {path}: {e}")
+
+    def rename(self, names, verbose=True):
+        """names with every alias replaced by its column name, unless a column already has that name."""
+        names = list(names)
+        for name in dict.fromkeys(names):
+            new_name = self.lookup.get(_column_key(name))
+            if new_name is None or new_name == name:
+                continue
+            if new_name in names:
+                if verbose:
+                    print(f"Warning: Cannot rename {name} to {new_name} - target name already exists")
+                continue
+            names = [new_name if n == name else n for n in names]
+        return names
+
+    def _normalize_id(self, value):
+        for pattern, replacement in self.id_rules:
+            value = pattern.sub(replacement, value)
+        return value
+
+    def normalize_ids(self, col):
+        """
+        col with the id rules applied: each distinct id is normalized once and the result is
+        broadcast back to the rows, a sample id repeated a million times costs one regex pass.
+        """
+        if not self.id_rules or not (col.dtype == object or isinstance(col.dtype, pd.StringDtype)):
+            return col
+        codes, uniques = col.factorize()
+        normalized = [self._normalize_id(v) if isinstance(v, str) else v for v in uniques]
+        # code -1 (missing) picks the None at the end
+        values = pd.Series(normalized + [None], dtype=col.dtype).take(codes)
+        return values.set_axis(col.index).rename(col.name)
+
+
+DEFAULT_RENAME_RULES = RenameRules()
+
+
+def rename_columns(df, handle_duplicates=True, duplicate_policy='ask', rules=None):
     """Modified rename_columns with duplicate handling"""
-    # Convert all column names to uppercase first
-    df.columns = df.columns.str.upper()
-    
-    rename_map = {
-        'PATIENT': 'PATIENT_ID',
-        'DSE_E': 'DFS_STATUS',
-        'DFS_months': 'DFS_MONTHS',
-        'death_event': 'OS_STATUS',
-        'GENDER': 'SEX'
-    }
-    
-    # Apply renames carefully
-    for old_name, new_name in rename_map.items():
-        if old_name in df.columns:
-            if new_name in df.columns:
-                print(f"Warning: Cannot rename {old_name} to {new_name} - target name already exists")
-            else:
-                df.rename(columns={old_name: new_name}, inplace=True)
+    rules = rules or DEFAULT_RENAME_RULES
+    # Convert all column names to uppercase first, the aliases do not care about case
+    df.columns = rules.rename(df.columns.str.upper())
     
     if 'SAMPLE_ID' not in df.columns:
         df['SAMPLE_ID'] = df['PATIENT_ID']
+    if rules.id_rules:
+        for i, col in enumerate(df.columns):
+            if col in ID_COLUMNS:
+                df.isetitem(i, rules.normalize_ids(df.iloc[:, i]))
     
     # Handle any duplicates that may have been created
-    df = handle_duplicate_columns(df)
+    if handle_duplicates:
+        df = handle_duplicate_columns(df, duplicate_policy)
     return df
 
 def prepare_meta_study(args):
@@ -213,141 +1319,894 @@ def prepare_meta_study(args):
         f"cancer_study_identifier: {args['csi']}\n",
         f"name: {args['n']}\n",
         f"description: {args['d']}\n",
-        f"add_global_case_list: true\n"
-        f"reference_genome: hg38"
+        # the case lists, cases_all included, are written with the sample file
+        f"add_global_case_list: false\n"
+        f"reference_genome: hg38\n"
     ]
     with open(f"{os.path.join(args['wd'], args['n'])}/meta_study.txt", 'w') as f:
         f.writelines(meta_study_content)
         
         
         
-def prepare_patient_data(df, patient_columns, args):
-    print(f"writing meta for clinica patient columns: {patient_columns}")
-  
+def prepare_patient_data(df, patient_columns, args, status_codes=None, index=None, stages=None):
+    logger.debug(f"writing meta for clinica patient columns: {patient_columns}")
+    write_patient_meta(args)
+    return split_patient_data(df, patient_columns, status_codes, index, stages)
+
 
+def write_patient_meta(args):
     meta_clinical_patient_content = [
         f"cancer_study_identifier: {args['csi']}\n",
         f"genetic_alteration_type: {args['gat']}\n",
         f"datatype: PATIENT_ATTRIBUTES\n",
-        "data_filename: data_clinical_patient.txt"
+        "data_filename: data_clinical_patient.txt\n"
     ]
     with open(f"{os.path.join(args['wd'], args['n'])}/meta_clinical_patient.txt", 'w') as f:
         f.writelines(meta_clinical_patient_content)
 
+
+def _status_key(value):
+    """Lookup key of a raw status value: 1, 1.0, "1.0" and " 1 " are all "1", text is upper-cased."""
+    if isinstance(value, (bool, np.bool_)):
+        value = int(value)
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else str(float(value))
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text.upper()
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def status_code_table(extra=None):
+    """STATUS_CODES with the extra {column: {raw value: code}} entries added, keyed by upper-case column."""
+    table = {}
+    for source in (STATUS_CODES, extra or {}):
+        for column, codes in source.items():
+            table.setdefault(column.upper(), {}).update({_status_key(k): v for k, v in codes.items()})
+    return table
+
+
+def map_status_codes(df, status_codes=None):
+    """
+    Maps the status columns of df to cBioPortal codes, one pass per column: the distinct values are
+    looked up once and the codes taken back by position. Values missing from the table are kept.
+    """
+    table = status_code_table(status_codes)
+    for i, column in enumerate(df.columns):
+        codes = table.get(str(column).upper())
+        if not codes:
+            continue
+        positions, uniques = pd.factorize(df.iloc[:, i])
+        keys = VOCABULARY.normalize('status', _status_key, list(uniques))
+        mapped = np.empty(len(uniques) + 1, dtype=object)
+        mapped[:] = [codes.get(key, u) for key, u in zip(keys, uniques)] + [np.nan]
+        df.isetitem(i, mapped[positions])
+    return df
+
+
+def map_distinct_values(col, func, kind=None):
+    """
+    func applied to every distinct value of col (not to every row), as an object array. NaN stays NaN.
+    With a kind the results go through the Vocabulary, func must then depend on the value alone.
+    """
+    positions, uniques = pd.factorize(col)
+    results = VOCABULARY.normalize(kind, func, list(uniques)) if kind else [func(u) for u in uniques]
+    mapped = np.array(results + [np.nan], dtype=object)
+    return mapped[positions]
+
+
+# float columns of whole numbers up to 2**24 are exact in float32 and print the same
+FLOAT32_EXACT = 2 ** 24
+
+
+def compact_frame(df):
+    """
+    Smaller in-memory representation of df, in place: text columns with few distinct values become
+    categoricals (a code per row, every value stored once), integers the smallest integer type and
+    floats of whole numbers float32. The values and the written files stay the same; the ids are not
+    touched. The patient and sample projections of the split then share these columns.
+    """
+    for i, column in enumerate(df.columns):
+        if column in ID_COLUMNS:
+            continue
+        col = df.iloc[:, i]
+        if isinstance(col.dtype, pd.StringDtype) or col.dtype == "object":
+            head = col.iloc[:VOCABULARY_COLUMN_VALUES]
+            if head.nunique() * 2 > len(head):
+                continue
+            positions, uniques = col.factorize()
+            # factorize() merges 1 and True of a mixed object column, those stay as they are
+            if len(uniques) * 2 <= len(col) and (col.dtype != "object" or all(type(u) is str for u in uniques)):
+                df.isetitem(i, pd.Categorical.from_codes(positions, uniques))
+        elif isinstance(col.dtype, np.dtype) and col.dtype.kind in "iu":
+            df.isetitem(i, pd.to_numeric(col, downcast='integer' if col.dtype.kind == "i" else 'unsigned'))
+        elif col.dtype == np.float64:
+            values = col.to_numpy()
+            values = values[~np.isnan(values)]
+            if (np.abs(values) <= FLOAT32_EXACT).all() and (values == np.round(values)).all():
+                df.isetitem(i, col.astype(np.float32))
+    return df
+
+
+def split_patient_data(df, patient_columns, status_codes=None, index=None, stages=None):
+    """
+    Patient rows of df with the survival status columns mapped to cBioPortal codes, one row per PATIENT_ID.
+    Pass the RecordIndex of the earlier chunks in streaming mode.
+    """
     p_df = df.filter(patient_columns, axis=1)
-    
-    for c in p_df.columns:
-      if c.upper() == "OS_STATUS":
-          p_df[c] = p_df[c].astype(str)
-          p_df.loc[p_df[c] == "0", c] = "0:LIVING"
-          p_df.loc[p_df[c] == "1", c] = "1:DECEASED"
-          p_df.loc[p_df[c] == "2", c] = "1:DECEASED"
-      if c.upper() == "DFS_STATUS":
-          p_df[c] = p_df[c].astype(str)
-          p_df.loc[p_df[c] == "0", c] = "0:DiseaseFree"
-          p_df.loc[p_df[c] == "1", c] = "1:Recurred"
-    p_df.drop_duplicates(inplace=True)
-    return p_df
-
-
-
-def prepare_sample_data(df, sample_columns, args):
+    with timed_stage(stages, 'map-status') as measured:
+        p_df = measure_frame(measured, map_status_codes(p_df, status_codes))
+    if index is None:
+        index = RecordIndex('PATIENT_ID')
+    return index.dedupe(p_df)
+
+
+
+def prepare_sample_data(df, sample_columns, args, index=None):
     #print("Removing patient-specific columns from sample data...")
-    print(f"writing meta for clinical sample columns: {sample_columns}")
-    s_df = df.filter(sample_columns, axis=1)
-    
+    logger.debug(f"writing meta for clinical sample columns: {sample_columns}")
+    write_sample_meta(args)
+    return split_sample_data(df, sample_columns, index)
 
+
+def write_sample_meta(args):
     meta_clinical_sample_content = [
         f"cancer_study_identifier: {args['csi']}\n",
         f"genetic_alteration_type: {args['gat']}\n",
         f"datatype: SAMPLE_ATTRIBUTES\n",
-        "data_filename: data_clinical_sample.txt"
+        "data_filename: data_clinical_sample.txt\n"
     ]
     with open(f"{os.path.join(args['wd'], args['n'])}/meta_clinical_sample.txt", 'w') as f:
         f.writelines(meta_clinical_sample_content)
-    s_df.drop_duplicates(inplace=True)
-    return s_df
 
 
+def split_sample_data(df, sample_columns, index=None):
+    """Sample rows of df restricted to the sample columns, one row per SAMPLE_ID."""
+    s_df = df.filter(sample_columns, axis=1)
+    if index is None:
+        index = RecordIndex('SAMPLE_ID')
+    return index.dedupe(s_df)
 
-def write_clini_data(df, f_name, work_dir, study_name):
-    print(f"Writing columns for {f_name}: {list(df.columns)}")  # Log the column names
-    df_cols = "\t".join(list(df.columns))
-    cols = '#' + df_cols + '\n'
 
-    column_types = []
-    for col in df.columns:
-        if col in ["T_STATUS", "TUMOR_STATUS", "METASTATIC_SITE"]:
-            col_type = "STRING"
-        elif col == "AGE":
-            col_type = "NUMBER"
-        elif col.endswith("_MONTHS") or col.lower().endswith("months"):
-            col_type = "NUMBER"
-        #elif df[col].dropna().astype(str).str.lower().isin(["yes", "no", "true", "false"]).all():
-            #col_type = "BOOLEAN"
-            # Convert BOOLEAN values to uppercase strings
-            df[col] = df[col].astype(str).str.lower().map({
-                "yes": "TRUE", 
-                "no": "FALSE", 
-                "true": "TRUE", 
-                "false": "FALSE"
-            })
+def row_hashes(df):
+    """
+    64 bit hash of every row, combined from one hash per column. Numbers are hashed as floats,
+    so a row hashes the same whether its chunk read a column as int, Int64 or float.
+    """
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(col.dtype) and not pd.api.types.is_bool_dtype(col.dtype):
+            col_hashes = pd.util.hash_array(col.to_numpy(dtype='float64', na_value=np.nan))
         else:
-            col_type = "STRING"
-        column_types.append(col_type)
-        print(f"Column '{col}' assigned type: {col_type}")
+            col_hashes = pd.util.hash_pandas_object(col, index=False).to_numpy()
+        hashes = (hashes * np.uint64(1000003)) ^ col_hashes
+    return hashes
 
-    sample_header = [
+
+def _plain(value):
+    """Python value of a numpy scalar, NaN/NA as None, so conflicts print and serialise cleanly."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+def _same_value(a, b):
+    a_missing, b_missing = pd.isna(a), pd.isna(b)
+    if a_missing or b_missing:
+        return a_missing and b_missing
+    return a == b
+
+
+class RecordIndex:
+    """
+    A 64 bit hash of the attributes of every PATIENT_ID/SAMPLE_ID written so far, so the rows
+    themselves are not kept. dedupe() drops repeated rows and rows whose id was already written
+    with other attributes; those are conflicts, the first row is kept and the conflict recorded.
+    Without the key column, rows are deduplicated on their hash alone.
+    """
+
+    def __init__(self, key, max_details=MAX_CONFLICT_DETAILS):
+        self.key = key
+        self.max_details = max_details
+        self.row_hashes = {}
+        self.conflicts = []
+        self.conflict_count = 0
+
+    def __len__(self):
+        return len(self.row_hashes)
+
+    def dedupe(self, df):
+        hashes = row_hashes(df)
+        # exact repeats and repeated ids inside the frame are found vectorized,
+        # only the first row of every id goes through the index
+        distinct = np.flatnonzero(~pd.Series(hashes).duplicated().to_numpy())
+        keys = df[self.key].to_numpy()[distinct] if self.key in df.columns else hashes[distinct]
+        first_of_key = ~pd.Series(keys).duplicated().to_numpy()
+        first_pos = dict(zip(keys[first_of_key].tolist(), distinct[first_of_key].tolist()))
+
+        keep = np.zeros(len(df), dtype=bool)
+        found = []
+        for key, pos in first_pos.items():
+            known = self.row_hashes.get(key)
+            if known is None:
+                self.row_hashes[key] = int(hashes[pos])
+                keep[pos] = True
+            elif known != hashes[pos]:
+                self.conflict_count += 1
+                found.append((key, pos, None))
+        repeated = np.flatnonzero(~first_of_key)
+        self.conflict_count += len(repeated)
+        for i in repeated[:self.max_details].tolist():
+            first = first_pos[keys[i]]
+            found.append((keys[i], distinct[i], first if keep[first] else None))
+        if found and len(self.conflicts) < self.max_details:
+            self._add_details(df, found[:self.max_details - len(self.conflicts)])
+        # nothing dropped: the columns stay shared with df instead of being copied
+        return df.copy(deep=False) if keep.all() else df[keep]
+
+    def _add_details(self, df, found):
+        # one take for all the rows involved instead of a row lookup per conflict
+        positions = sorted({pos for _, pos, _ in found} | {first for _, _, first in found if first is not None})
+        rows = dict(zip(positions, df.iloc[positions].to_numpy(dtype=object)))
+        columns = list(df.columns)
+        for key, pos, first_pos in found:
+            row = rows[pos]
+            if first_pos is None:
+                # the kept row was written with an earlier chunk and is no longer in memory
+                values = {col: _plain(v) for col, v in zip(columns, row) if col != self.key}
+                self.conflicts.append({'key': self.key, 'id': _plain(key), 'values': values})
+                continue
+            differences = {col: [_plain(a), _plain(b)] for col, a, b in zip(columns, rows[first_pos], row)
+                           if not _same_value(a, b)}
+            self.conflicts.append({'key': self.key, 'id': _plain(key), 'differences': differences})
+
+    def report(self, f_name, limit=10):
+        """Prints the conflicts found, returns them."""
+        if not self.conflict_count:
+            return self.conflicts
+        print(f"\n{self.conflict_count} row(s) for {f_name} have the {self.key} of an earlier row but other "
+              f"values, the first row of each {self.key} was kept:")
+        for conflict in self.conflicts[:limit]:
+            if 'differences' in conflict:
+                details = ", ".join(f"{col}: {kept!r} (kept) / {other!r}"
+                                    for col, (kept, other) in conflict['differences'].items())
+            else:
+                details = ", ".join(f"{col}: {value!r}" for col, value in conflict['values'].items())
+                details += " (the kept row came with an earlier chunk)"
+            print(f"  {self.key} {conflict['id']}: {details}")
+        if self.conflict_count > limit:
+            print(f"  ... and {self.conflict_count - limit} more")
+        return self.conflicts
+
+
+
+@dataclass
+class ColumnProfile:
+    """What the profiler found out about a column."""
+    col_type: str
+    non_null: int = 0
+    sampled: int = 0
+    # the type guessed from the sample did not hold for the whole column
+    rejected: str = None
+
+
+def _sample_values(values, size, seed=0):
+    """Uniform sample of at most size values, the same one on every run."""
+    if len(values) <= size:
+        return values
+    rng = np.random.default_rng(seed)
+    return values[np.sort(rng.choice(len(values), size, replace=False))]
+
+
+def _guess_type(values):
+    """NUMBER/BOOLEAN/STRING of a few non-empty values."""
+    words = {str(v).strip().lower() for v in pd.unique(values)}
+    if words <= BOOLEAN_VALUES.keys():
+        return "BOOLEAN"
+    if pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').notna().all():
+        return "NUMBER"
+    return "STRING"
+
+
+def _holds_for(values, col_type):
+    """One vectorized pass checking that every non-empty value of the column fits col_type."""
+    if col_type == "BOOLEAN":
+        return {str(v).strip().lower() for v in pd.unique(values)} <= BOOLEAN_VALUES.keys()
+    if col_type == "NUMBER":
+        return bool(pd.to_numeric(values, errors='coerce').notna().all())
+    return True
+
+
+def profile_column(col, sample_size=PROFILE_SAMPLE_SIZE):
+    """
+    cBioPortal attribute type of a column, decided from its values: the type is guessed on a sample
+    of the non-empty values and then checked once against the whole column.
+    The ids and STRING_COLUMNS are always STRING; empty columns fall back to the name (AGE, *_MONTHS).
+    """
+    name = str(col.name)
+    if name in STRING_COLUMNS:
+        return ColumnProfile("STRING")
+    values = col.dropna()
+    if values.empty:
+        numeric_name = name == "AGE" or name.endswith("_MONTHS") or name.lower().endswith("months")
+        return ColumnProfile("NUMBER" if numeric_name else "STRING")
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return ColumnProfile("BOOLEAN", len(values))
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return ColumnProfile("NUMBER", len(values))
+
+    sample = _sample_values(values.to_numpy(dtype=object), sample_size)
+    col_type = _guess_type(sample)
+    profile = ColumnProfile(col_type, len(values), len(sample))
+    if col_type != "STRING" and not _holds_for(values, col_type):
+        profile.col_type, profile.rejected = "STRING", col_type
+    return profile
+
+
+def _boolean_text(value):
+    return BOOLEAN_VALUES.get(str(value).strip().lower(), value)
+
+
+def clini_column_types(df, verbose=True, workers=1, profiles=None):
+    """
+    cBioPortal attribute type of every column in df, BOOLEAN columns are rewritten as TRUE/FALSE in place.
+    profiles caches the ColumnProfile per column name: columns already in it are not profiled again,
+    only checked against the values of df, and a NUMBER/BOOLEAN column they do not fit becomes STRING
+    (streaming mode: the header of the file is then rewritten when it is closed, see TsvWriter.set_header).
+    """
+    profiles = {} if profiles is None else profiles
+    missing = [i for i, col in enumerate(df.columns) if col not in profiles]
+    if missing:
+        for i, profile in zip(missing, map_columns(df.iloc[:, missing], profile_column, workers)):
+            profiles[df.columns[i]] = profile
+    for i, col in enumerate(df.columns):
+        profile = profiles[col]
+        if profile.col_type == "STRING" or i in missing:
+            continue
+        if not _holds_for(df.iloc[:, i].dropna(), profile.col_type):
+            print(f"Column '{col}' has values that are not {profile.col_type} in a later chunk, "
+                  f"it is written as STRING.")
+            profiles[col] = ColumnProfile("STRING", profile.non_null, profile.sampled, profile.col_type)
+
+    column_types = []
+    for i, col in enumerate(df.columns):
+        profile = profiles[col]
+        if profile.col_type == "BOOLEAN":
+            df.isetitem(i, map_distinct_values(df.iloc[:, i], _boolean_text, 'boolean'))
+        column_types.append(profile.col_type)
+        if verbose:
+            rejected = f" (not {profile.rejected}: some values do not fit)" if profile.rejected else ""
+            logger.debug(f"Column '{col}' assigned type: {profile.col_type}{rejected}")
+    return column_types
+
+
+class TsvWriter:
+    """
+    Tab separated data file behind a large write buffer. The rows go to a temporary file next to path,
+    converted to text by pandas batch_rows rows at a time, and close() renames it into place,
+    so readers never see a half written file. As a context manager it is removed again on an error.
+    """
+
+    def __init__(self, path, header_lines=(), batch_rows=TSV_BATCH_ROWS, buffer_size=TSV_BUFFER_SIZE):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.rows = 0
+        directory, name = os.path.split(path)
+        self._partial = os.path.join(directory, f".{name}.{os.getpid()}.partial")
+        self._file = open(self._partial, 'w', buffering=buffer_size, newline='')
+        self._header = self._written_header = "".join(line + '\n' for line in header_lines)
+        self._file.write(self._header)
+
+    def set_header(self, header_lines):
+        """Header lines that replace the ones the file was opened with, when it is closed."""
+        self._header = "".join(line + '\n' for line in header_lines)
+
+    def write(self, df):
+        df.to_csv(self._file, header=False, index=False, sep="\t", lineterminator='\n', chunksize=self.batch_rows)
+        self.rows += len(df)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._header != self._written_header:
+            # the rows are copied once behind the new header
+            with open(self._partial, 'rb') as rows, open(self._partial + '.header', 'wb') as f:
+                f.write(self._header.encode())
+                rows.seek(len(self._written_header.encode()))
+                shutil.copyfileobj(rows, f, TSV_BUFFER_SIZE)
+            os.replace(self._partial + '.header', self._partial)
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_clini_data(df, f_name, work_dir, study_name, workers=1, profiles=None):
+    """
+    TsvWriter of a cBioPortal clinical data file, with the 5 header lines built from the columns
+    and the column types of df (BOOLEAN columns of df are converted in place). No rows are written yet.
+    """
+    logger.debug(f"Writing columns for {f_name}: {list(df.columns)}")  # Log the column names
+    column_types = clini_column_types(df, workers=workers, profiles=profiles)
+    return TsvWriter(os.path.join(work_dir, study_name, f_name), clini_header(df.columns, column_types))
+
+
+def clini_header(columns, column_types):
+    """The 5 header lines of a clinical data file."""
+    df_cols = "\t".join(list(columns))
+    cols = '#' + df_cols
+    sample_header = [
         cols,
         cols,
-        "#" + "\t".join(column_types) + '\n',
-        "#" + "\t".join(["1" for _ in range(len(list(df.columns)))]) + '\n',
-        df_cols.upper() + '\n'
+        "#" + "\t".join(column_types),
+        "#" + "\t".join(["1" for _ in range(len(list(columns)))]),
+        df_cols.upper()
     ]
+    return sample_header
 
-    df = df.to_csv(header=None, index=False, sep="\t",lineterminator='\n')
-  
-    with open(f"{os.path.join(work_dir, study_name)}/{f_name}", "w") as f:
-        f.writelines(sample_header)
-        f.write(df)
-        
-        
-        
-def main():
-    args = parse_arguments()
-    print(f"args:   {args}")  
-    
-    patient_columns = ['PATIENT_ID', 'AGE', 'SEX', 'DFS_MONTHS', 'OS_MONTHS', 'OS_STATUS', 'DFS_STATUS', 'TUMOR_SITE','study','compassid','pooledcompassid']
-    Irrelevent_columns = ['Relative_Path_1','Relative_Path_2']
 
+def append_clini_data(writer, df, workers=1, profiles=None):
+    """
+    Adds the rows of df to an open clinical data file, converted to the column types of its header.
+    A column widened to STRING by these rows gets its new type in the header.
+    """
+    column_types = clini_column_types(df, verbose=False, workers=workers, profiles=profiles)
+    writer.set_header(clini_header(df.columns, column_types))
+    writer.write(df)
 
-    if not exists(os.path.join(args['wd'], args['n'])):
-        os.mkdir(os.path.join(args['wd'], args['n']))
-        
-    
-   
 
-    df = read_input_file(args['f'])
-    print("name of the features/ collumns in the input file:")
-    print(df.columns)  
-    df = clean_dataframe(df)
-    df = rename_columns(df)
-    prepare_meta_study(args)
-    key_columns = ['PATIENT_ID', 'SAMPLE_ID']
-    df = df.dropna(subset=key_columns, how='any')
-    # For Prining and testing output and debugging
-    print("DataFrame after cleaning and renaming columns: check if that is what you want you want")
-    print(df.head())
-    
-    df.to_excel("output.xlsx", index=False)
-    
-    print("Parsing to cBioPortal study structure if possible...")
+def write_clini_data(df, f_name, work_dir, study_name, workers=1, profiles=None):
+    """Writes df as a cBioPortal clinical data file."""
+    with open_clini_data(df, f_name, work_dir, study_name, workers, profiles) as writer:
+        writer.write(df)
+
+
+class OutputQueue:
+    """
+    The files of a study written on a pool of threads: submit() queues a write and returns at once,
+    so the next table is split while the one before is converted to text and written, and the slow
+    open/write/close round trips of a network share overlap. wait() returns once every file is written
+    and raises the first error. threads=1 writes each file when it is submitted.
+    """
+
+    def __init__(self, stages=None, threads=OUTPUT_THREADS):
+        self.stages = stages
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="study-output") if threads > 1 else None
+        self._futures = []
+
+    def submit(self, stage, path, func, *args, df=None):
+        """
+        Runs func(*args) (df is added to the arguments) as the timed stage, path is the file it writes
+        or None when func returns the names of the files it wrote. Returns a future of func's result.
+        """
+        def run():
+            with timed_stage(self.stages, stage) as measured:
+                if df is not None:
+                    measure_frame(measured, df)
+                value = func(*args) if df is None else func(df, *args)
+                if path is not None:
+                    measured['bytes_written'] = _file_size(path)
+            return value
+
+        if self._pool is None:
+            future = Future()
+            future.set_result(run())
+        else:
+            future = self._pool.submit(run)
+        self._futures.append(future)
+        return future
+
+    def wait(self):
+        if self._pool is None:
+            return
+        try:
+            wait(self._futures)
+        finally:
+            self._pool.shutdown()
+        for future in self._futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.wait()
+        elif self._pool is not None:
+            # the error of the conversion is the one to report, the queued files are not needed any more
+            self._pool.shutdown(cancel_futures=True)
+
+
+# Gene columns: the default gene list is extended or replaced with gene_list files
+GENE_SYMBOLS = frozenset(['APC', 'BRAF', 'KRAS', 'NRAS', 'TP53', 'PIK3CA', 'SMAD4', 'FBXW7', 'PTEN', 'ERBB2',
+                          'EGFR', 'MLH1', 'MSH2', 'MSH6', 'PMS2', 'POLE', 'CTNNB1', 'SOX9', 'ARID1A', 'TCF7L2'])
+# any other value of a gene column (mut, yes, G12D, V600E, ...) is a mutation, except a silent change (G12G)
+WILD_TYPE_VALUES = frozenset(['wt', 'wildtype', 'wild type', 'wild-type', 'no', 'false', 'neg', 'negative', '0'])
+NOT_PROFILED_VALUES = frozenset(['', 'na', 'n/a', 'n.a.', 'nan', 'none', 'unknown', 'not tested', 'not done', 'nd',
+                                 'not profiled', 'failed'])
+# a protein change like G12D or p.V600E, the only mutated values that get a row in data_mutations.txt
+PROTEIN_CHANGE = re.compile(r"(?:p\.)?([ACDEFGHIKLMNPQRSTVWY])(\d+)([ACDEFGHIKLMNPQRSTVWY*])")
+
+
+def load_gene_list(path):
+    """
+    HUGO symbols of a gene list file, upper-cased: one gene per line, or the first column of a
+    tsv/csv (a Hugo_Symbol/gene header line and # comments are skipped).
+    """
+    genes = set()
+    with open(path) as f:
+        for line in f:
+            symbol = re.split(r"[\t,; ]", line.strip(), maxsplit=1)[0].upper()
+            if symbol and not symbol.startswith('#') and symbol not in ('HUGO_SYMBOL', 'GENE', 'SYMBOL'):
+                genes.add(symbol)
+    return frozenset(genes)
+
+
+def detect_gene_columns(columns, genes=GENE_SYMBOLS):
+    """The columns named like a gene of the set (case-insensitive), in column order."""
+    return [col for col in columns if str(col).upper() in genes]
+
+
+def _mutation_code(value):
+    """
+    1 mutated, 0 wild type, -1 not profiled. A variant (G12D) or mut/yes/1 is a mutation,
+    a silent change (G12G) leaves the protein as it is and counts as wild type.
+    """
+    word = _status_key(value).lower()
+    if word in WILD_TYPE_VALUES:
+        return 0
+    if word in NOT_PROFILED_VALUES:
+        return -1
+    change = PROTEIN_CHANGE.fullmatch(str(value).strip())
+    if change is not None and change.group(1) == change.group(3):
+        return 0
+    return 1
+
+
+@dataclass
+class GeneMatrix:
+    """
+    Sample x gene mutation status as int8 codes: 1 mutated, 0 wild type, -1 not profiled.
+    mutations has a (sample, gene, value) row per mutated cell, with the value of the input (G12D, mut, ...).
+    """
+    samples: 'np.ndarray'
+    genes: list
+    codes: 'np.ndarray'
+    mutations: 'pd.DataFrame' = None
+
+    @classmethod
+    def from_frame(cls, df, gene_columns, sample_column='SAMPLE_ID'):
+        """Codes of the gene columns of df, one row per sample (the first row of a repeated SAMPLE_ID)."""
+        df = df.loc[~df[sample_column].duplicated(), [sample_column] + list(gene_columns)]
+        samples = df[sample_column].to_numpy(dtype=object)
+        genes = [str(g).upper() for g in gene_columns]
+        codes = np.empty((len(df), len(gene_columns)), dtype=np.int8)
+        mutations = []
+        for j, col in enumerate(gene_columns):
+            # the raw values are looked up once per distinct value, a missing value (-1) is not profiled
+            positions, uniques = df[col].factorize()
+            lookup = np.array([_mutation_code(u) for u in uniques] + [-1], dtype=np.int8)
+            codes[:, j] = lookup[positions]
+            mutated = np.flatnonzero(codes[:, j] == 1)
+            mutations.append(pd.DataFrame({'sample': samples[mutated], 'gene': genes[j],
+                                           'value': np.asarray(uniques, dtype=object)[positions[mutated]]}))
+        return cls(samples, genes, codes, pd.concat(mutations, ignore_index=True))
+
+    @classmethod
+    def concat(cls, matrices):
+        """One matrix of the chunks of a streamed input, samples already seen in an earlier chunk are dropped."""
+        samples = np.concatenate([m.samples for m in matrices])
+        first = ~pd.Series(samples).duplicated().to_numpy()
+        # the mutations of a chunk count for the samples it brought first
+        offsets = np.cumsum([0] + [len(m.samples) for m in matrices])
+        mutations = [m.mutations[m.mutations['sample'].isin(m.samples[first[start:start + len(m.samples)]])]
+                     for m, start in zip(matrices, offsets)]
+        # gene by gene like from_frame(), the samples of a gene in input order
+        order = {gene: j for j, gene in enumerate(matrices[0].genes)}
+        mutations = pd.concat(mutations, ignore_index=True).sort_values('gene', key=lambda g: g.map(order),
+                                                                        kind='stable', ignore_index=True)
+        return cls(samples[first], matrices[0].genes, np.concatenate([m.codes for m in matrices])[first], mutations)
+
+    def profiled(self):
+        """Samples with a status for at least one gene."""
+        return (self.codes >= 0).any(axis=1)
+
+
+def _maf_variant(value):
+    """
+    Variant_Classification and HGVSp_Short of a mutated value of a gene column,
+    None when it is not a protein change (mut, yes, 1: the input does not say what the variant is).
+    """
+    change = PROTEIN_CHANGE.fullmatch(str(value).strip())
+    if change is None:
+        return None
+    before, position, after = change.groups()
+    classification = 'Nonsense_Mutation' if after == '*' else 'Missense_Mutation'
+    return classification, f"p.{before}{position}{after}"
+
+
+def write_gene_matrix(matrix, args, panel_id):
+    """
+    Writes the gene panel matrix of a study (meta_gene_panel_matrix.txt, data_gene_panel_matrix.txt),
+    the definition of the panel (gene_panel_<id>.txt, to import with importGenePanel) and the mutation
+    profile the matrix refers to (meta_mutations.txt, data_mutations.txt: a minimal MAF with a row per
+    mutated gene of a sample whose value is a protein change). Returns the file names.
+    """
+    study_dir = os.path.join(args['wd'], args['n'])
+    print(f"Writing gene panel {panel_id} with {len(matrix.genes)} genes for {len(matrix.samples)} samples")
+
+    meta_gene_panel_content = [
+        f"cancer_study_identifier: {args['csi']}\n",
+        "genetic_alteration_type: GENE_PANEL_MATRIX\n",
+        "datatype: GENE_PANEL_MATRIX\n",
+        "data_filename: data_gene_panel_matrix.txt\n"
+    ]
+    with open(os.path.join(study_dir, "meta_gene_panel_matrix.txt"), 'w') as f:
+        f.writelines(meta_gene_panel_content)
+
+    panel = pd.DataFrame({'SAMPLE_ID': matrix.samples,
+                          'mutations': np.where(matrix.profiled(), panel_id, 'NA')})
+    with TsvWriter(os.path.join(study_dir, "data_gene_panel_matrix.txt"), ["SAMPLE_ID\tmutations"]) as writer:
+        writer.write(panel)
+
+    with open(os.path.join(study_dir, f"gene_panel_{panel_id}.txt"), 'w') as f:
+        f.write(f"stable_id: {panel_id}\n")
+        f.write(f"description: Genes of the {args['n']} clinical file\n")
+        f.write("gene_list:\t" + "\t".join(matrix.genes) + "\n")
+
+    # the 'mutations' column of the panel matrix and cases_sequenced refer to this profile
+    meta_mutations_content = [
+        f"cancer_study_identifier: {args['csi']}\n",
+        "genetic_alteration_type: MUTATION_EXTENDED\n",
+        "datatype: MAF\n",
+        "stable_id: mutations\n",
+        "show_profile_in_analysis_tab: true\n",
+        "profile_name: Mutations\n",
+        f"profile_description: Mutation status of the {len(matrix.genes)} gene columns of the clinical file\n",
+        "data_filename: data_mutations.txt\n"
+    ]
+    with open(os.path.join(study_dir, "meta_mutations.txt"), 'w') as f:
+        f.writelines(meta_mutations_content)
+
+    mutations = matrix.mutations
+    # each distinct value is classified once
+    positions, uniques = pd.factorize(mutations['value'])
+    variants = [_maf_variant(u) for u in uniques]
+    parsed = np.array([v is not None for v in variants] + [False])[positions]
+    if not parsed.all():
+        print(f"{(~parsed).sum()} mutated values are not a protein change (like G12D), "
+              f"they are counted in the gene panel matrix but not written to data_mutations.txt")
+    positions = positions[parsed]
+    variants = np.array([v or ('', '') for v in variants] + [('', '')], dtype=object).reshape(-1, 2)
+    maf = pd.DataFrame({'Hugo_Symbol': mutations['gene'].to_numpy()[parsed],
+                        'Tumor_Sample_Barcode': mutations['sample'].to_numpy()[parsed],
+                        'Variant_Classification': variants[positions, 0], 'HGVSp_Short': variants[positions, 1]})
+    with TsvWriter(os.path.join(study_dir, "data_mutations.txt"), ["\t".join(maf.columns)]) as writer:
+        writer.write(maf)
+    return ["meta_gene_panel_matrix.txt", "data_gene_panel_matrix.txt", f"gene_panel_{panel_id}.txt",
+            "meta_mutations.txt", "data_mutations.txt"]
+
+
+def study_gene_columns(df, config):
+    """The gene columns of df: config.gene_columns, or the columns matching the gene list."""
+    if config.gene_columns:
+        missing = [col for col in config.gene_columns if col not in df.columns]
+        if missing:
+            print(f"Gene columns not found in the input file: {missing}")
+        return [col for col in config.gene_columns if col in df.columns]
+    genes = load_gene_list(config.gene_list) if config.gene_list else GENE_SYMBOLS
+    return detect_gene_columns(df.columns, genes)
+
+
+RESERVED_CASE_LISTS = ('all', 'sequenced')
+
+
+def case_list_column(column, columns, rules=None):
+    """
+    The column of the cleaned and renamed header (columns) a case list 'where' column refers to,
+    matched like read_plan() does: 'Kras' is KRAS and an alias renamed by the rules is its new name.
+    """
+    key = _column_key(column)
+    renamed = (rules or DEFAULT_RENAME_RULES).lookup.get(key)
+    for name in (key, renamed):
+        if name is not None and name in columns:
+            return name
+    raise StudyConversionError(f"Case list column '{column}' is not in the input file.")
+
+
+def case_list_mask(df, where):
+    """
+    Rows of df matching every {column: value or [values]} of where, compared as trimmed
+    case-insensitive text.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, wanted in where.items():
+        if column not in df.columns:
+            raise StudyConversionError(f"Case list column '{column}' is not in the input file.")
+        wanted = wanted if isinstance(wanted, list) else [wanted]
+        wanted = {str(v).strip().lower() for v in wanted}
+        # one comparison per distinct value instead of per row
+        positions, uniques = df[column].factorize()
+        lookup = np.array([str(u).strip().lower() in wanted for u in uniques] + [False])
+        mask &= lookup[positions]
+    return mask
+
+
+class CaseLists:
+    """
+    The case lists of a study. cases_all is the SAMPLE_ID index of the sample file, cases_sequenced the
+    samples profiled in the gene panel matrix; the lists of the case_lists config key are filled with
+    add() from the rows of every sample chunk written.
+    """
+
+    def __init__(self, definitions=None, rules=None):
+        self.definitions = definitions or {}
+        self.rules = rules
+        self.ids = {suffix: [] for suffix in self.definitions}
+
+    def resolve(self, columns):
+        """Renames the 'where' columns of the definitions to the columns of the renamed header, see case_list_column()."""
+        self.definitions = {
+            suffix: dict(definition, where={case_list_column(column, columns, self.rules): values
+                                            for column, values in definition['where'].items()})
+            for suffix, definition in self.definitions.items()}
+        return self
+
+    def columns(self):
+        """The columns add() looks at."""
+        where = [column for definition in self.definitions.values() for column in definition['where']]
+        return ['SAMPLE_ID'] + [column for column in dict.fromkeys(where) if column != 'SAMPLE_ID']
+
+    def add(self, df):
+        samples = df['SAMPLE_ID'].to_numpy(dtype=object)
+        for suffix, definition in self.definitions.items():
+            self.ids[suffix].extend(samples[case_list_mask(df, definition['where'])].tolist())
+
+    def write(self, args, sample_ids, gene_matrix=None):
+        """Writes case_lists/cases_<suffix>.txt files, returns their names relative to the study directory."""
+        lists = [('all', "All samples", "All samples", 'all_cases_in_study', list(sample_ids))]
+        if gene_matrix is not None:
+            lists.append(('sequenced', "Samples with mutation data", "Samples profiled for mutations",
+                          'all_cases_with_mutation_data', gene_matrix.samples[gene_matrix.profiled()].tolist()))
+        for suffix, definition in self.definitions.items():
+            where = ", ".join(f"{column} = " + "/".join(str(v) for v in (values if isinstance(values, list) else [values]))
+                              for column, values in definition['where'].items())
+            lists.append((suffix, definition.get('name', suffix), definition.get('description', f"Samples with {where}"),
+                          definition.get('category'), self.ids[suffix]))
+
+        directory = os.path.join(args['wd'], args['n'], "case_lists")
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for suffix, name, description, category, ids in lists:
+            if not ids:
+                print(f"Case list {suffix} has no samples, not written.")
+                continue
+            content = [
+                f"cancer_study_identifier: {args['csi']}\n",
+                f"stable_id: {args['csi']}_{suffix}\n",
+                f"case_list_name: {name}\n",
+                f"case_list_description: {description} ({len(ids)} samples)\n",
+            ]
+            if category:
+                content.append(f"case_list_category: {category}\n")
+            content.append("case_list_ids: " + "\t".join(str(i) for i in ids) + "\n")
+            with open(os.path.join(directory, f"cases_{suffix}.txt"), 'w') as f:
+                f.writelines(content)
+            files.append(f"case_lists/cases_{suffix}.txt")
+        print(f"Wrote {len(files)} case lists.")
+        return files
+
+
+class PreviewWriter:
+    """
+    Writes the first rows of the cleaned data to preview_cleaned.<format> in the study directory,
+    a chunk at a time: parquet row groups, appended csv or an openpyxl write-only sheet.
+    max_rows=0 writes every row.
+    """
+
+    def __init__(self, study_dir, fmt, max_rows=PREVIEW_ROWS):
+        self.name = f"preview_cleaned.{fmt}"
+        self.path = os.path.join(study_dir, self.name)
+        self.fmt = fmt
+        self.left = max_rows if max_rows else float('inf')
+        self.rows = 0
+        self._writer = None
+        module = {'parquet': 'pyarrow', 'xlsx': 'openpyxl'}.get(fmt)
+        if module:
+            try:
+                __import__(module)
+            except ImportError:
+                raise StudyConversionError(f"A {fmt} preview needs {module} (uv pip install {module}), "
+                                           f"or use --preview csv.")
+
+    def write(self, df):
+        if self.left <= 0 or self._writer is False:
+            return
+        df = df.iloc[:self.left] if self.left < len(df) else df
+        if self.fmt == 'csv':
+            df.to_csv(self.path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        elif self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            try:
+                table = table.cast(self._writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError) as e:
+                # a column changed type between chunks, keep what was written so far
+                print(f"Note: the preview stops after {self.rows} rows ({e}).")
+                self.close()
+                self._writer = False
+                return
+            self._writer.write_table(table)
+        else:
+            if self._writer is None:
+                from openpyxl import Workbook
+                self._writer = Workbook(write_only=True)
+                self._sheet = self._writer.create_sheet()
+                self._sheet.append([str(c) for c in df.columns])
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+                self._sheet.append(row)
+        self.rows += len(df)
+        self.left -= len(df)
+
+    def close(self):
+        if self._writer:
+            if self.fmt == 'xlsx':
+                self._writer.save(self.path)
+            else:
+                self._writer.close()
+        self._writer = None
+        if self.rows:
+            print(f"Preview of {self.rows} cleaned rows written to {self.path}")
+
+
+def select_study_columns(df, patient_columns, Irrelevent_columns, interactive=True, sample_columns=None):
+    """
+    Asks the user for irrelevant/patient/sample columns and returns the ones found in df.
+    Without interaction the given lists are used, sample_columns=None meaning all the other columns.
+    """
+    if not interactive:
+        Found_patient_columns = [col for col in patient_columns if col in df.columns]
+        if sample_columns is not None:
+            Found_sample_columns = [col for col in sample_columns if col in df.columns]
+        else:
+            irrelevant = {_column_key(col) for col in Irrelevent_columns}
+            Found_sample_columns = [col for col in df.columns
+                                    if col not in Found_patient_columns
+                                    and col not in irrelevant
+                                    or col == 'PATIENT_ID']
+        return Found_patient_columns, Found_sample_columns
+
     # Taking question from the user if there are any irrellevant columns in the data
     Modify_irrelevent_columns = input("do you want to specify irrelevent columns. Press y for yes and n for no(tool will search predefined irrelevent collumns features in the data) :  ")
     if Modify_irrelevent_columns == 'y':
         Irrelevent_columns = input("Enter the patient columns separated by commas: ").split(",")
         Irrelevent_columns = [col.strip() for col in Irrelevent_columns]
-        print(f"Found irrelevent columns: {Irrelevent_columns}")
+        logger.debug(f"Found irrelevent columns: {Irrelevent_columns}")
     else:
         print("Using default irrelerent columns.") 
     
@@ -367,38 +2226,797 @@ def main():
     Modify2 = input("do you want to specify sample_collumns. If Press y, the tool will look for the collums you define in the input file. If Press n, the tool will take all the collumns in found sample collumn without the patient collumns(This usually is most of the case) :  ")
     if Modify2 == 'y':
         sample_columns = input("Enter the patient columns separated by commas: ").split(",")
-        sample_columns = [col.strip() for col in patient_columns]
+        sample_columns = [col.strip() for col in sample_columns]
         Found_sample_columns = [col for col in sample_columns if col in df.columns]
     if Modify2 == 'n':
+        irrelevant = {_column_key(col) for col in Irrelevent_columns}
         Found_sample_columns = [col for col in df.columns 
                         if col not in Found_patient_columns 
-                        and col not in Irrelevent_columns  # Exclude irrelevant columns
+                        and col not in irrelevant  # Exclude irrelevant columns
                         or col == 'PATIENT_ID']# Keep the PATIENT_ID column
+    return Found_patient_columns, Found_sample_columns
+
+
+def timed_chunks(chunks, stages):
+    """The chunks of iter_input_chunks(), the time spent reading each one goes to the read stage."""
+    chunks = iter(chunks)
+    while True:
+        with timed_stage(stages, 'read') as measured:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                measure_frame(measured, chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_study(config, result):
+    """
+    Streaming mode of run_study(): every chunk of the input is cleaned, renamed, split and appended
+    to data_clinical_patient.txt / data_clinical_sample.txt before the next one is read.
+    The column decisions are taken once on the first chunk and reused for the rest.
+    The data files are renamed into place once the whole input went through.
+    """
+    args = config.args()
+    stages = result.stages
+    key_columns = ['PATIENT_ID', 'SAMPLE_ID']
+    rules = config.rename_rules()
+    with timed_stage(stages, 'plan'):
+        usecols, dtype = read_plan(config, rules)
+    chunks = timed_chunks(iter_input_chunks(args['f'], config.chunksize, config.bad_lines, config.drop_columns,
+                                            result.malformed_lines, config.sheet, config.excel_cache, usecols,
+                                            dtype), stages)
+    duplicate_mask = None
+    Found_patient_columns = Found_sample_columns = None
+    patient_index, sample_index = RecordIndex('PATIENT_ID'), RecordIndex('SAMPLE_ID')
+    patient_profiles, sample_profiles = {}, {}
+    patient_file = sample_file = None
+    gene_columns, gene_chunks = None, []
+    case_lists = CaseLists(config.case_lists, rules)
+    preview = PreviewWriter(result.study_dir, config.preview, config.preview_rows) if config.preview else None
+
+    with ExitStack() as writers:
+        for i, chunk in enumerate(chunks):
+            if config.incremental:
+                result.chunk_digests.append(row_digest(chunk))
+            if config.arrow_strings:
+                to_arrow_strings(chunk)
+            with timed_stage(stages, 'clean') as measured:
+                chunk = measure_frame(measured, clean_dataframe(chunk, drop_empty_columns=False,
+                                                                workers=config.workers))
+            with timed_stage(stages, 'rename') as measured:
+                chunk = measure_frame(measured, rename_columns(chunk, handle_duplicates=False, rules=rules))
+            with timed_stage(stages, 'dedupe-columns') as measured:
+                if duplicate_mask is None:
+                    duplicate_mask = duplicate_column_mask(chunk, config.duplicate_columns)
+                chunk = measure_frame(measured, chunk.loc[:, duplicate_mask])
+            chunk = chunk.dropna(subset=key_columns, how='any')
+            result.rows += len(chunk)
+            if preview:
+                preview.write(chunk)
+
+            if i == 0:
+                logger.debug("name of the features/ collumns in the input file:")
+                logger.debug(chunk.columns)
+                with timed_stage(stages, 'write-meta'):
+                    prepare_meta_study(args)
+                result.files.append("meta_study.txt")
+                print("First chunk after cleaning and renaming columns: check if that is what you want you want")
+                print(chunk.head())
+                print("Parsing to cBioPortal study structure if possible...")
+                Found_patient_columns, Found_sample_columns = select_study_columns(
+                    chunk, config.patient_columns, config.irrelevant_columns, config.interactive, config.sample_columns)
+                result.patient_columns, result.sample_columns = Found_patient_columns, Found_sample_columns
+                if len(Found_patient_columns) == 1 and Found_patient_columns[0] == 'PATIENT_ID':
+                    print("Only PATIENT_ID column found in the input file. No patient-specific columns to process.")
+                if not Found_sample_columns:
+                    print("No Sample columns found in the input file. It is required to have it.")
+                    break
+
+            if len(Found_patient_columns) > 1:
+                if i == 0:
+                    logger.debug(f"Found patient columns: {Found_patient_columns}")
+                    with timed_stage(stages, 'split') as measured:
+                        p_df = measure_frame(measured, prepare_patient_data(
+                            chunk, Found_patient_columns, args, config.status_codes, patient_index, stages))
+                    with timed_stage(stages, 'write-patient') as measured:
+                        patient_file = writers.enter_context(open_clini_data(
+                            p_df, "data_clinical_patient.txt", args['wd'], args['n'], config.workers, patient_profiles))
+                        patient_file.write(measure_frame(measured, p_df))
+                    result.files += ["meta_clinical_patient.txt", "data_clinical_patient.txt"]
+                else:
+                    with timed_stage(stages, 'split') as measured:
+                        p_df = measure_frame(measured, split_patient_data(
+                            chunk, Found_patient_columns, config.status_codes, patient_index, stages))
+                    with timed_stage(stages, 'write-patient') as measured:
+                        append_clini_data(patient_file, measure_frame(measured, p_df), config.workers,
+                                          patient_profiles)
+
+            if len(Found_sample_columns) > 1:
+                if i == 0:
+                    logger.debug(f"Found sample columns: {Found_sample_columns}")
+                    with timed_stage(stages, 'split') as measured:
+                        s_df = measure_frame(measured, prepare_sample_data(
+                            chunk, Found_sample_columns, args, sample_index))
+                    case_lists.resolve(chunk.columns).add(chunk.loc[s_df.index])
+                    with timed_stage(stages, 'write-sample') as measured:
+                        sample_file = writers.enter_context(open_clini_data(
+                            s_df, "data_clinical_sample.txt", args['wd'], args['n'], config.workers, sample_profiles))
+                        sample_file.write(measure_frame(measured, s_df))
+                    result.files += ["meta_clinical_sample.txt", "data_clinical_sample.txt"]
+                else:
+                    with timed_stage(stages, 'split') as measured:
+                        s_df = measure_frame(measured, split_sample_data(chunk, Found_sample_columns, sample_index))
+                    case_lists.add(chunk.loc[s_df.index])
+                    with timed_stage(stages, 'write-sample') as measured:
+                        append_clini_data(sample_file, measure_frame(measured, s_df), config.workers,
+                                          sample_profiles)
+
+            if config.gene_panel:
+                if gene_columns is None:
+                    gene_columns = study_gene_columns(chunk, config)
+                if gene_columns:
+                    gene_chunks.append(GeneMatrix.from_frame(chunk, gene_columns))
+
+        else:
+            print(f"Streamed {result.rows} rows in chunks of {config.chunksize}.")
+    # the data files have their final size once the writers are closed
+    for stage, name in (('write-patient', "data_clinical_patient.txt"), ('write-sample', "data_clinical_sample.txt")):
+        if stage in stages:
+            stages[stage]['bytes_written'] = _file_size(os.path.join(result.study_dir, name))
+    result.conflicts += patient_index.report("data_clinical_patient.txt")
+    result.conflicts += sample_index.report("data_clinical_sample.txt")
+    gene_matrix = GeneMatrix.concat(gene_chunks) if gene_chunks else None
+    if gene_matrix is not None:
+        with timed_stage(stages, 'write-genes') as measured:
+            measured['rows'], measured['columns'] = len(gene_matrix.samples), len(gene_matrix.genes)
+            result.files += write_gene_matrix(gene_matrix, args, config.gene_panel)
+    elif config.gene_panel:
+        print("No gene columns found in the input file, no gene panel matrix written.")
+    if sample_file is not None:
+        with timed_stage(stages, 'write-case-lists'):
+            result.files += case_lists.write(args, sample_index.row_hashes, gene_matrix)
+    if preview:
+        preview.close()
+        if preview.rows:
+            result.files.append(preview.name)
+    return result
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Logs to the sys.stdout of the moment, so redirect_stdout() (batch conversion.log) gets the log too."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def configure_logging(level='info'):
+    """Log messages are printed like the rest of the output, below level they are dropped."""
+    if not logger.handlers:
+        handler = _StdoutHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level.upper())
+
+
+def current_rss_mb():
+    """Resident memory of the process now (the peak where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# the OutputQueue threads time their writes into the same stages dict
+_STAGES_LOCK = threading.Lock()
+
+
+@contextmanager
+def timed_stage(stages, name):
+    """
+    Times a stage into stages[name] (a StudyResult.stages dict, or None to not record anything).
+    The caller fills in what the stage went through with the yielded dict ('rows', 'columns',
+    'bytes_written'); a stage run once per chunk adds up, its rss_delta_mb is the largest of the calls.
+    """
+    measured = {'rows': None, 'columns': None, 'bytes_written': None}
+    rss = current_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        seconds = time.perf_counter() - start
+        if stages is not None:
+            delta = round(current_rss_mb() - rss, 1)
+            with _STAGES_LOCK:
+                record = stages.setdefault(name, {'seconds': 0.0, 'rows': None, 'columns': None, 'bytes_written': None,
+                                                  'rss_delta_mb': None, 'calls': 0})
+                record['seconds'] = round(record['seconds'] + seconds, 4)
+                record['calls'] += 1
+                record['rss_delta_mb'] = delta if record['rss_delta_mb'] is None \
+                    else max(record['rss_delta_mb'], delta)
+                for key in ('rows', 'bytes_written'):
+                    if measured[key] is not None:
+                        record[key] = (record[key] or 0) + measured[key]
+                if measured['columns'] is not None:
+                    record['columns'] = measured['columns']
+
+
+def measure_frame(measured, df):
+    measured['rows'] = len(df)
+    measured['columns'] = len(df.columns)
+    return df
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def write_metrics(result, config):
+    """Writes result.stages to conversion_metrics.jsonl (one json object per stage) or conversion_metrics.prom."""
+    stages = dict(result.stages)
+    stages['total'] = {'seconds': result.seconds, 'rows': result.rows, 'columns': None, 'calls': 1,
+                       'bytes_written': sum(_file_size(os.path.join(result.study_dir, name)) or 0
+                                            for name in result.files),
+                       'rss_delta_mb': None}
+    if config.metrics == 'jsonl':
+        path = os.path.join(result.study_dir, "conversion_metrics.jsonl")
+        with open(path, 'w') as f:
+            for name, record in stages.items():
+                f.write(json.dumps({'study': config.study_name, 'stage': name, **record}) + "\n")
+    else:
+        # Prometheus text exposition format, for the node exporter textfile collector
+        path = os.path.join(result.study_dir, "conversion_metrics.prom")
+        metrics = [('seconds', 'cbioportal_stage_seconds', "Wall time of the conversion stage"),
+                   ('rows', 'cbioportal_stage_rows', "Rows that went through the stage"),
+                   ('columns', 'cbioportal_stage_columns', "Columns that went through the stage"),
+                   ('bytes_written', 'cbioportal_stage_bytes_written', "Bytes written by the stage"),
+                   ('rss_delta_mb', 'cbioportal_stage_rss_delta_megabytes', "Resident memory change of the stage")]
+        lines = []
+        for key, metric, text in metrics:
+            lines += [f"# HELP {metric} {text}", f"# TYPE {metric} gauge"]
+            lines += [f'{metric}{{study="{config.study_name}",stage="{name}"}} {record[key]}'
+                      for name, record in stages.items() if record.get(key) is not None]
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+    logger.info(f"Stage metrics written to {path}")
+    return path
+
+
+@contextmanager
+def profiled(path):
+    """Profiles the block into path: pyinstrument html for a .html path, cProfile stats otherwise."""
+    if path is None:
+        yield
+        return
+    if path.endswith(".html"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise StudyConversionError("An html profile needs pyinstrument (uv pip install pyinstrument), "
+                                       "or give a .prof path for cProfile.")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    print(f"Profile written to {path}")
+
+
+def run_study(config):
+    """
+    Converts config.file into the study directory config.work_dir/config.study_name.
+    Questions are only asked when config.interactive is set, see convert_study() for unattended runs.
+    """
+    configure_logging(config.log_level)
+    start = time.perf_counter()
+    if config.vocabulary_cache:
+        VOCABULARY.load(config.vocabulary_cache)
+    hits, misses = VOCABULARY.hits, VOCABULARY.misses
+    with profiled(config.profile):
+        result = run_incremental(config) if config.incremental else run_staged(config)
+    logger.debug(f"Vocabulary: {VOCABULARY.hits - hits} values looked up, {VOCABULARY.misses - misses} normalized")
+    if config.vocabulary_cache:
+        VOCABULARY.save(config.vocabulary_cache)
+    if config.validate_output and not result.skipped:
+        from cBioportal_study_validator import print_report, validate_study
+        with timed_stage(result.stages, 'validate') as measured:
+            # the validator checks a file per process on every core, whatever the column workers
+            result.validation = validate_study(result.study_dir)
+            measured['rows'] = len(result.validation)
+        print_report(result.validation, result.study_dir, result.stages['validate']['seconds'])
+    result.seconds = round(time.perf_counter() - start, 3)
+    if config.metrics and not result.skipped:
+        write_metrics(result, config)
+    return result
+
+
+def _run_conversion(config):
+    args = config.args()
+    result = StudyResult(study_dir=os.path.join(args['wd'], args['n']))
+
+
+    if not exists(os.path.join(args['wd'], args['n'])):
+        os.mkdir(os.path.join(args['wd'], args['n']))
+        
+    if config.chunksize:
+        return stream_study(config, result)
+   
+
+    stages = result.stages
+    rules = config.rename_rules()
+    with timed_stage(stages, 'plan'):
+        usecols, dtype = read_plan(config, rules)
+    with timed_stage(stages, 'read') as measured:
+        df = measure_frame(measured, read_input_file(args['f'], config.bad_lines, config.drop_columns,
+                                                     result.malformed_lines, config.sheet, config.excel_cache,
+                                                     usecols, dtype))
+        if config.arrow_strings:
+            to_arrow_strings(df)
+    if config.incremental:
+        result.chunk_digests = [row_digest(df.iloc[start:start + CACHE_CHUNK_ROWS])
+                                for start in range(0, len(df), CACHE_CHUNK_ROWS)]
+    logger.debug("name of the features/ collumns in the input file:")
+    logger.debug(df.columns)
+    with timed_stage(stages, 'clean') as measured:
+        df = measure_frame(measured, clean_dataframe(df, workers=config.workers))
+    with timed_stage(stages, 'rename') as measured:
+        df = measure_frame(measured, rename_columns(df, handle_duplicates=False, rules=rules))
+    with timed_stage(stages, 'dedupe-columns') as measured:
+        df = measure_frame(measured, handle_duplicate_columns(df, config.duplicate_columns))
+    # forking the column workers while other threads write is not safe, they write one after another then
+    output = OutputQueue(stages, config.output_threads if config.workers <= 1 else 1)
+    written = []
+    with output:
+        output.submit('write-meta', os.path.join(result.study_dir, "meta_study.txt"), prepare_meta_study, args)
+        result.files.append("meta_study.txt")
+        key_columns = ['PATIENT_ID', 'SAMPLE_ID']
+        df = df.dropna(subset=key_columns, how='any')
+        result.rows = len(df)
+        # For Prining and testing output and debugging
+        print("DataFrame after cleaning and renaming columns: check if that is what you want you want")
+        print(df.head())
+    
+        if config.preview:
+            preview = PreviewWriter(result.study_dir, config.preview, config.preview_rows)
+            for start in range(0, min(len(df), preview.left), CACHE_CHUNK_ROWS):
+                preview.write(df.iloc[start:start + CACHE_CHUNK_ROWS])
+            preview.close()
+            if preview.rows:
+                result.files.append(preview.name)
+        with timed_stage(stages, 'compact') as measured:
+            df = measure_frame(measured, compact_frame(df))
+    
+        print("Parsing to cBioPortal study structure if possible...")
+        Found_patient_columns, Found_sample_columns = select_study_columns(
+            df, config.patient_columns, config.irrelevant_columns, config.interactive, config.sample_columns)
+        result.patient_columns, result.sample_columns = Found_patient_columns, Found_sample_columns
     
     
     
-    ## Check patients collumn only consist of PATIENT_ID 
-    ## if all the minimum required columns are not found in the input file
-    if len(Found_patient_columns) == 1 and Found_patient_columns[0] == 'PATIENT_ID':
-        print(f'Found patient columns length: {len(Found_patient_columns)}')
-        print("Only PATIENT_ID column found in the input file. No patient-specific columns to process.")
+        ## Check patients collumn only consist of PATIENT_ID 
+        ## if all the minimum required columns are not found in the input file
+        if len(Found_patient_columns) == 1 and Found_patient_columns[0] == 'PATIENT_ID':
+            print(f'Found patient columns length: {len(Found_patient_columns)}')
+            print("Only PATIENT_ID column found in the input file. No patient-specific columns to process.")
         
       
     
-    if  len(Found_patient_columns) > 1:
-        print(f"Found patient columns: {Found_patient_columns}")
-        p_df = prepare_patient_data(df, Found_patient_columns, args)
-        write_clini_data(p_df, "data_clinical_patient.txt", args['wd'], args['n'])
-        
-    if len(Found_sample_columns) > 1:
-        print(f"Found sample columns: {Found_sample_columns}")
-        s_df = prepare_sample_data(df, Found_sample_columns, args)
-        write_clini_data(s_df, "data_clinical_sample.txt", args['wd'], args['n'])
-       
+        if  len(Found_patient_columns) > 1:
+            logger.debug(f"Found patient columns: {Found_patient_columns}")
+            patient_index = RecordIndex('PATIENT_ID')
+            output.submit('write-meta', os.path.join(result.study_dir, "meta_clinical_patient.txt"),
+                          write_patient_meta, args)
+            with timed_stage(stages, 'split') as measured:
+                p_df = measure_frame(measured, split_patient_data(df, Found_patient_columns, config.status_codes,
+                                                                  patient_index, stages))
+            result.conflicts += patient_index.report("data_clinical_patient.txt")
+            # written while the sample data is split
+            output.submit('write-patient', os.path.join(result.study_dir, "data_clinical_patient.txt"),
+                          write_clini_data, "data_clinical_patient.txt", args['wd'], args['n'], config.workers,
+                          df=p_df)
+            result.files += ["meta_clinical_patient.txt", "data_clinical_patient.txt"]
         
+        if len(Found_sample_columns) > 1:
+            logger.debug(f"Found sample columns: {Found_sample_columns}")
+            sample_index = RecordIndex('SAMPLE_ID')
+            output.submit('write-meta', os.path.join(result.study_dir, "meta_clinical_sample.txt"),
+                          write_sample_meta, args)
+            with timed_stage(stages, 'split') as measured:
+                s_df = measure_frame(measured, split_sample_data(df, Found_sample_columns, sample_index))
+            result.conflicts += sample_index.report("data_clinical_sample.txt")
+            case_lists = CaseLists(config.case_lists, rules).resolve(df.columns)
+            case_lists.add(df.loc[s_df.index, [c for c in case_lists.columns() if c in df.columns]])
+            output.submit('write-sample', os.path.join(result.study_dir, "data_clinical_sample.txt"),
+                          write_clini_data, "data_clinical_sample.txt", args['wd'], args['n'], config.workers,
+                          df=s_df)
+            result.files += ["meta_clinical_sample.txt", "data_clinical_sample.txt"]
+
+        gene_matrix = None
+        if config.gene_panel:
+            gene_columns = study_gene_columns(df, config)
+            if gene_columns:
+                logger.debug(f"Found gene columns: {gene_columns}")
+                gene_matrix = GeneMatrix.from_frame(df, gene_columns)
+                written.append(output.submit('write-genes', None, write_gene_matrix, gene_matrix, args,
+                                             config.gene_panel))
+            else:
+                print("No gene columns found in the input file, no gene panel matrix written.")
+
+        if len(Found_sample_columns) > 1:
+            written.append(output.submit('write-case-lists', None, case_lists.write, args, sample_index.row_hashes,
+                                         gene_matrix))
+    # the gene panel and case list files, known once they are written
+    for names in written:
+        result.files += names.result()
+
     if not Found_sample_columns:
         print("No Sample columns found in the input file. It is required to have it.")
-        return 0
+    return result
+
+
+CACHE_FILE = ".cbioportal_build_cache.json"
+# the files a staged run wrote into the study directory, removed by the next run when it does not write them
+STUDY_FILES = ".cbioportal_study_files.json"
+CACHE_CHUNK_ROWS = 100000
+# settings that do not change what is written
+CACHE_IGNORED_FIELDS = {'file', 'work_dir', 'workers', 'output_threads', 'incremental', 'interactive', 'excel_cache',
+                        'metrics', 'profile', 'log_level', 'vocabulary_cache', 'validate_output'}
+
+
+def file_digest(path, cached=None):
+    """
+    sha256 of a file, read in 1 MB blocks. A cached entry with the same size and mtime is reused,
+    so an untouched multi-GB input is not read again.
+    """
+    stat = os.stat(path)
+    if cached and cached.get('size') == stat.st_size and cached.get('mtime_ns') == stat.st_mtime_ns:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'sha256': digest.hexdigest(), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def config_digest(config):
+    """Digest of the config values that decide the output, plus the parser itself."""
+    values = {f.name: getattr(config, f.name) for f in fields(config) if f.name not in CACHE_IGNORED_FIELDS}
+    values['parser'] = file_digest(os.path.abspath(__file__))['sha256']
+    # the files the config points to decide the output by their content
+    for key in ('synonyms', 'gene_list'):
+        if getattr(config, key):
+            values[key] = file_digest(getattr(config, key))['sha256']
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def row_digest(df):
+    """Digest of a chunk of input rows."""
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha256(hashes.tobytes()).hexdigest()[:16]
+
+
+def load_build_cache(study_dir):
+    try:
+        with open(os.path.join(study_dir, CACHE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def previous_study_files(study_dir):
+    """The files the last run wrote into the study directory, staged (STUDY_FILES) or incremental (CACHE_FILE)."""
+    try:
+        with open(os.path.join(study_dir, STUDY_FILES)) as f:
+            files = json.load(f)
+    except (FileNotFoundError, ValueError):
+        files = []
+    return list(dict.fromkeys(files + list(load_build_cache(study_dir).get('files', {}))))
+
+
+def remove_stale_files(study_dir, files, old_files):
+    """Removes the files of the previous run that are not in files (a gene panel or case list left out now)."""
+    for name in old_files:
+        if name not in files and os.path.exists(os.path.join(study_dir, name)):
+            os.remove(os.path.join(study_dir, name))
+
+
+def publish_study_files(staging_dir, study_dir, files, old_files=()):
+    """
+    Moves the staged files into the study directory, except those whose content is the same as
+    the file already there: they are left alone so their mtime does not change. Files of the
+    previous run that are no longer produced are removed. Returns {name: sha256} and the unchanged names.
+    """
+    digests, unchanged = {}, []
+    for name in files:
+        staged = os.path.join(staging_dir, name)
+        target = os.path.join(study_dir, name)
+        digests[name] = file_digest(staged)['sha256']
+        if os.path.exists(target) and file_digest(target)['sha256'] == digests[name]:
+            unchanged.append(name)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(staged, target)
+    remove_stale_files(study_dir, digests, old_files)
+    return digests, unchanged
+
+
+def commit_study_files(staging_dir, study_dir, files, old_files=()):
+    """
+    Moves the staged files into the study directory, each one replaces its old version at once.
+    Files of the previous run that are no longer produced are removed, the new list goes to STUDY_FILES.
+    """
+    for name in files:
+        target = os.path.join(study_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(os.path.join(staging_dir, name), target)
+    remove_stale_files(study_dir, files, old_files)
+    with open(os.path.join(study_dir, STUDY_FILES), 'w') as f:
+        json.dump(list(files), f, indent=1)
+
+
+def run_staged(config):
+    """
+    _run_conversion() in a staging directory next to the study directory. The files are moved into
+    the study directory once every one of them is written, a failed run leaves the study as it was.
+    """
+    study_dir = os.path.join(config.work_dir, config.study_name)
+    staging = tempfile.mkdtemp(prefix=f".{config.study_name}.", dir=config.work_dir)
+    try:
+        result = _run_conversion(replace(config, work_dir=staging))
+        commit_study_files(os.path.join(staging, config.study_name), study_dir, result.files,
+                           previous_study_files(study_dir))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    result.study_dir = study_dir
+    return result
+
+
+def run_incremental(config):
+    """
+    run_study() with a build cache in the study directory: the input digest, the config digest,
+    a digest per chunk of input rows and the digest of every file written.
+    """
+    study_dir = os.path.join(config.work_dir, config.study_name)
+    cache = load_build_cache(study_dir)
+    try:
+        input_digest = file_digest(config.file, cache.get('input'))
+    except FileNotFoundError:
+        raise StudyConversionError(f"Error: The file {config.file} was not found.")
+    except OSError as e:
+        raise StudyConversionError(f"Error: The file {config.file} could not be read: {e}")
+    settings_digest = config_digest(config)
+
+    outputs = cache.get('files', {})
+    if (cache.get('input', {}).get('sha256') == input_digest['sha256']
+            and cache.get('config') == settings_digest
+            and all(os.path.exists(os.path.join(study_dir, name)) for name in outputs)):
+        print(f"{config.study_name}: input and config unchanged, nothing to do.")
+        return StudyResult(study_dir=study_dir, files=list(outputs), rows=cache.get('rows', 0),
+                           skipped=True, unchanged_files=list(outputs), chunk_digests=cache.get('chunks', []))
+
+    os.makedirs(study_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{config.study_name}.", dir=config.work_dir)
+    try:
+        result = _run_conversion(replace(config, work_dir=staging))
+        digests, result.unchanged_files = publish_study_files(
+            os.path.join(staging, config.study_name), study_dir, result.files, previous_study_files(study_dir))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    result.study_dir = study_dir
+
+    old_chunks = cache.get('chunks', [])
+    result.changed_chunks = [i for i, digest in enumerate(result.chunk_digests)
+                             if i >= len(old_chunks) or old_chunks[i] != digest]
+    if old_chunks:
+        print(f"{len(result.changed_chunks)} of {len(result.chunk_digests)} input chunks changed, "
+              f"{len(result.unchanged_files)} of {len(result.files)} files kept as they were.")
+
+    with open(os.path.join(study_dir, CACHE_FILE), 'w') as f:
+        json.dump({
+            'input': input_digest,
+            'config': settings_digest,
+            'chunks': result.chunk_digests,
+            'files': digests,
+            'rows': result.rows,
+        }, f, indent=1)
+    return result
+
+
+def _excel_first_row(file_path, sheet):
+    """
+    First row of a sheet. calamine loads the whole sheet before giving its first row,
+    openpyxl in read-only mode stops after it, so it is used when it is installed.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        return next(_excel_rows(file_path, sheet), ())
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = _workbook_sheet(file_path, sheet, workbook.sheetnames)
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        return next(worksheet.iter_rows(values_only=True), ())
+    finally:
+        workbook.close()
+
+
+def read_input_header(file_path, sheet=0):
+    """
+    Column names of the input without reading its rows: the first line of a csv, the first row of
+    the excel sheet, the schema of a parquet/feather file. pandas is not needed for any of them.
+    """
+    if not exists(file_path):
+        raise StudyConversionError(f"Error: The file {file_path} was not found.")
+    fmt = COLUMNAR_FORMATS.get(os.path.splitext(file_path)[1].lower())
+    if fmt is not None:
+        # the file footer/schema only, pyarrow.dataset would take longer to import than to read it
+        try:
+            import pyarrow.parquet as pq
+            import pyarrow.ipc as ipc
+        except ImportError:
+            raise StudyConversionError(f"Reading {file_path} needs pyarrow (uv pip install pyarrow).")
+        if fmt == 'parquet':
+            return list(pq.read_schema(file_path).names)
+        with ipc.open_file(file_path) as reader:
+            return list(reader.schema.names)
+    if file_path.endswith(".xlsx"):
+        sheet = excel_sheet_name(file_path, sheet)
+        cache = _fresh_excel_cache(file_path, sheet)
+        if cache:
+            import pyarrow.parquet as pq
+            return list(pq.read_schema(cache).names)
+        return _excel_header(_excel_first_row(file_path, sheet))
+    import csv
+    with open(file_path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        # the names pandas gives the columns, repeated names get .1, .2, ... (utf-8-sig: without a BOM, like pandas)
+        return _excel_header(next(csv.reader(f), []))
+
+
+def plan_columns(header, config, rules=None):
+    """
+    What the conversion would do with the columns of header: their names after cleaning and renaming
+    ('names', one per header column), and the patient, sample and gene columns among them
+    (as select_study_columns() picks them unattended) and the columns of the case list conditions.
+    """
+    rules = rules or config.rename_rules()
+    names = rules.rename([_column_key(col) for col in header], verbose=False)
+    columns = list(dict.fromkeys(names))
+    if 'SAMPLE_ID' not in columns and 'PATIENT_ID' in columns:
+        columns.append('SAMPLE_ID')
+    duplicated = sorted({col for col in names if names.count(col) > 1})
+    patient_columns = [col for col in config.patient_columns if col in columns]
+    if config.sample_columns is not None:
+        sample_columns = [col for col in config.sample_columns if col in columns]
+    else:
+        irrelevant = {_column_key(col) for col in config.irrelevant_columns}
+        sample_columns = [col for col in columns
+                          if col not in patient_columns and col not in irrelevant
+                          or col == 'PATIENT_ID']
+    gene_columns = []
+    if config.gene_panel:
+        if config.gene_columns:
+            gene_columns = [col for col in config.gene_columns if col in columns]
+        else:
+            genes = load_gene_list(config.gene_list) if config.gene_list else GENE_SYMBOLS
+            gene_columns = detect_gene_columns(columns, genes)
+    # an unknown case list column fails here, before the input is read
+    case_list_columns = [case_list_column(col, columns, rules)
+                         for definition in (config.case_lists or {}).values() for col in definition['where']]
+    return {'names': names, 'columns': columns, 'duplicated': duplicated, 'patient_columns': patient_columns,
+            'sample_columns': sample_columns, 'gene_columns': gene_columns,
+            'case_list_columns': list(dict.fromkeys(case_list_columns))}
+
+
+def read_plan(config, rules=None):
+    """
+    The header positions an unattended conversion uses and the csv dtypes to read them with, so the
+    other columns are never parsed: (usecols, dtype), None for a part that has nothing to change.
+    The ids are read as text, 007 stays 007 and an id column with gaps does not turn into 1.0, 2.0.
+    Interactive runs and previews see every column.
+    """
+    if config.interactive or config.preview:
+        return None, None
+    rules = rules or config.rename_rules()
+    header = read_input_header(config.file, config.sheet)
+    plan = plan_columns(header, config, rules)
+    used = set(plan['patient_columns']) | set(plan['sample_columns']) | set(plan['gene_columns'])
+    used.update(ID_COLUMNS)
+    used.update(plan['case_list_columns'])
+    # a column that blocks a rename has to be there for rename_columns() to see it
+    used.update(rules.lookup[name] for name in plan['names'] if name in rules.lookup)
+    usecols = [i for i, name in enumerate(plan['names']) if name in used or name in plan['duplicated']]
+    dtype = None
+    if not config.file.endswith('.xlsx') and COLUMNAR_FORMATS.get(os.path.splitext(config.file)[1].lower()) is None:
+        dtype = {header[i]: str for i, name in enumerate(plan['names']) if name in ID_COLUMNS} or None
+    if len(usecols) == len(header):
+        usecols = None
+    else:
+        print(f"Reading {len(usecols)} of the {len(header)} columns of {config.file}")
+    return usecols, dtype
+
+
+def dry_run(config):
+    """
+    Checks a study without converting it: the config is validated and only the header of the input
+    is read. Returns the plan_columns() of the input, raises StudyConversionError on a problem.
+    """
+    config.validate()
+    plan = plan_columns(read_input_header(config.file, config.sheet), config)
+    if 'PATIENT_ID' not in plan['columns']:
+        raise StudyConversionError(f"{config.file} has no PATIENT/PATIENT_ID column.")
+    print(f"{config.study_name}: {config.file} has {len(plan['columns'])} columns")
+    print(f"  patient columns: {plan['patient_columns']}")
+    print(f"  sample columns:  {len(plan['sample_columns'])}")
+    logger.debug(f"  {plan['sample_columns']}")
+    if config.gene_panel:
+        print(f"  gene columns:    {plan['gene_columns']}")
+    if plan['case_list_columns']:
+        print(f"  case list columns: {plan['case_list_columns']}")
+    if plan['duplicated']:
+        print(f"  duplicated columns, resolved with '{config.duplicate_columns}': {plan['duplicated']}")
+    if len(plan['sample_columns']) <= 1:
+        print("  Warning: no sample columns, the study would have no sample file.")
+    return plan
+
+
+def convert_study(config):
+    """
+    Converts one study without asking anything.
+    config is a StudyConfig, a dict of its fields or the path of a json/yaml config file.
+    Returns a StudyResult, raises StudyConversionError when the study cannot be converted.
+    """
+    if isinstance(config, str):
+        config = load_config(config)
+    elif isinstance(config, dict):
+        config = StudyConfig.from_dict(config)
+    config.validate()
+    return run_study(config)
+
+
+def main():
+    options = parse_options()
+    try:
+        if options.dry_run:
+            config = config_from_options(options)
+            configure_logging(config.log_level)
+            if not exists(config.work_dir):
+                raise StudyConversionError(f"The work dir {config.work_dir} does not exist.")
+            return dry_run(config)
+        if options.config or options.file:
+            result = convert_study(config_from_options(options))
+            if result.skipped:
+                print(f"Study {result.study_dir} is up to date.")
+            else:
+                print(f"Study written to {result.study_dir} in {result.seconds} s: {result.files}")
+            return result
+        args = parse_arguments()
+        print(f"args:   {args}")  
+        return run_study(config_from_prompts(args, options).validate())
+    except StudyConversionError as e:
+        print(e)
+        exit(1)
     
    
 
@@ -0,0 +1,355 @@
+"""
+Checks a cBioPortal study directory for the problems the importer would reject, without starting it:
+the fields of the meta files, the 5 header lines and the values of the clinical data files, the
+sample -> patient references and the ids of the case lists and the gene panel matrix.
+Every file is checked on its own worker process while it is read line by line, only the id sets
+come back for the checks between files.
+
+    python cBioportal_study_validator.py ./studies/DACHS --jobs 4
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+
+ATTRIBUTE_TYPES = {'STRING', 'NUMBER', 'BOOLEAN'}
+BOOLEAN_TEXT = {'TRUE', 'FALSE'}
+# empty values the importer accepts in any column (compared in lower case)
+NULL_VALUES = {'', 'na', 'nan', '[not applicable]', '[not available]', '[pending]', '[discrepancy]',
+               '[completed]', '[null]'}
+ID_PATTERN = re.compile(r"[A-Za-z0-9._-]+")
+REFERENCE_GENOMES = {'hg19', 'hg38', 'mm10'}
+META_KEYS = ['type_of_cancer', 'cancer_study_identifier', 'name', 'short_name', 'description', 'citation', 'pmid',
+             'groups', 'add_global_case_list', 'reference_genome', 'genetic_alteration_type', 'datatype',
+             'data_filename', 'stable_id', 'profile_name', 'profile_description', 'show_profile_in_analysis_tab']
+# fields with a single token for a value, where a glued key cannot be part of free text
+SINGLE_VALUE_KEYS = {'type_of_cancer', 'cancer_study_identifier', 'add_global_case_list', 'reference_genome',
+                     'genetic_alteration_type', 'datatype', 'data_filename', 'stable_id',
+                     'show_profile_in_analysis_tab'}
+# a field glued to the end of the line before it: "add_global_case_list: falsereference_genome: hg38"
+GLUED_KEY = re.compile(r"\S(" + "|".join(sorted(META_KEYS, key=len, reverse=True)) + "):")
+REQUIRED_META_KEYS = {
+    'study': ['type_of_cancer', 'cancer_study_identifier', 'name', 'description'],
+    'PATIENT_ATTRIBUTES': ['cancer_study_identifier', 'genetic_alteration_type', 'datatype', 'data_filename'],
+    'SAMPLE_ATTRIBUTES': ['cancer_study_identifier', 'genetic_alteration_type', 'datatype', 'data_filename'],
+    'GENE_PANEL_MATRIX': ['cancer_study_identifier', 'genetic_alteration_type', 'datatype', 'data_filename'],
+    'case_list': ['cancer_study_identifier', 'stable_id', 'case_list_name', 'case_list_description',
+                  'case_list_ids'],
+}
+# problems of one kind reported per file, the rest are counted
+MAX_REPORTED = 10
+
+
+@dataclass
+class Issue:
+    level: str
+    file: str
+    line: int
+    message: str
+
+    def __str__(self):
+        where = f"{self.file}:{self.line}" if self.line else self.file
+        return f"{self.level} {where}: {self.message}"
+
+
+class _FileReport:
+    """Issues of one file, at most MAX_REPORTED of each message kind are kept."""
+
+    def __init__(self, name):
+        self.name = name
+        self.issues = []
+        self.counts = {}
+        self.levels = {}
+
+    def add(self, level, line, message, kind=None):
+        kind = kind or message
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.levels[kind] = level
+        if self.counts[kind] <= MAX_REPORTED:
+            self.issues.append(Issue(level, self.name, line, message))
+
+    def error(self, line, message, kind=None):
+        self.add('ERROR', line, message, kind)
+
+    def warning(self, line, message, kind=None):
+        self.add('WARNING', line, message, kind)
+
+    def finish(self):
+        for kind, count in self.counts.items():
+            if count > MAX_REPORTED:
+                self.issues.append(Issue(self.levels[kind], self.name, None, f"{count - MAX_REPORTED} more: {kind}"))
+        return self.issues
+
+
+def read_meta_file(path, report):
+    """The key: value fields of a meta (or case list) file, problems with the format go to report."""
+    fields = {}
+    with open(path, newline='') as f:
+        text = f.read()
+    if text and not text.endswith('\n'):
+        report.warning(None, "no line break at the end of the file")
+    for n, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        key, sep, value = line.partition(':')
+        key, value = key.strip(), value.strip()
+        if not sep or not key:
+            report.error(n, f"'{line[:60]}' is not a 'key: value' line")
+            continue
+        if key in fields:
+            report.error(n, f"'{key}' is given twice")
+        glued = GLUED_KEY.search(value) if key in SINGLE_VALUE_KEYS else None
+        if glued:
+            report.error(n, f"'{key}' runs into '{glued.group(1)}:', a line break is missing")
+        fields[key] = value
+    return fields
+
+
+def meta_kind(fields):
+    if 'type_of_cancer' in fields:
+        return 'study'
+    if 'case_list_ids' in fields:
+        return 'case_list'
+    return fields.get('datatype')
+
+
+def check_meta_file(path, name):
+    """Checks a meta or case list file. Returns its issues and fields."""
+    report = _FileReport(name)
+    fields = read_meta_file(path, report)
+    kind = meta_kind(fields)
+    for key in REQUIRED_META_KEYS.get(kind, ['cancer_study_identifier', 'genetic_alteration_type', 'datatype']):
+        if not fields.get(key):
+            report.error(None, f"'{key}' is missing")
+    if kind == 'study':
+        if fields.get('add_global_case_list', 'false').lower() not in ('true', 'false'):
+            report.error(None, f"add_global_case_list must be true or false, not '{fields['add_global_case_list']}'")
+        if fields.get('reference_genome', 'hg19') not in REFERENCE_GENOMES:
+            report.error(None, f"reference_genome must be one of {sorted(REFERENCE_GENOMES)}, "
+                               f"not '{fields['reference_genome']}'")
+    if kind == 'case_list':
+        csi, stable_id = fields.get('cancer_study_identifier', ''), fields.get('stable_id', '')
+        if stable_id and not stable_id.startswith(csi + '_'):
+            report.error(None, f"stable_id '{stable_id}' does not start with '{csi}_'")
+    return {'issues': report.finish(), 'fields': fields}
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def check_clinical_file(path, name, datatype):
+    """
+    Checks a clinical data file line by line: the 5 header lines, the field count, the ids and the values
+    of the NUMBER/BOOLEAN columns. Returns its issues, its ids and (sample files) the patients they refer to.
+    """
+    report = _FileReport(name)
+    id_column = 'PATIENT_ID' if datatype == 'PATIENT_ATTRIBUTES' else 'SAMPLE_ID'
+    ids, patients = set(), set()
+    result = {'issues': report.issues, 'ids': ids, 'patients': patients}
+    with open(path, newline='') as f:
+        header = []
+        for _ in range(5):
+            line = f.readline()
+            if not line:
+                break
+            header.append(line.rstrip('\r\n').split('\t'))
+        if len(header) < 5:
+            report.error(None, "the file needs 4 '#' header lines and the column names")
+            result['issues'] = report.finish()
+            return result
+        for n, fields in enumerate(header[:4], 1):
+            if not fields[0].startswith('#'):
+                report.error(n, "header lines 1 to 4 start with '#'")
+        columns = header[4]
+        width = len(columns)
+        for n, fields in enumerate(header[:4], 1):
+            if len(fields) != width:
+                report.error(n, f"{len(fields)} fields in the header line, the file has {width} columns")
+        types = [t.lstrip('#').strip().upper() for t in header[2]]
+        for column, col_type in zip(columns, types):
+            if col_type not in ATTRIBUTE_TYPES:
+                report.error(3, f"column {column} has the type '{col_type}', not one of {sorted(ATTRIBUTE_TYPES)}")
+        for column, priority in zip(columns, header[3]):
+            if not priority.lstrip('#').strip().lstrip('-').isdigit():
+                report.error(4, f"column {column} has the priority '{priority}', not a number")
+        duplicated = sorted({c for c in columns if columns.count(c) > 1})
+        if duplicated:
+            report.error(5, f"columns {duplicated} are there more than once")
+        required = [id_column] + (['PATIENT_ID'] if datatype == 'SAMPLE_ATTRIBUTES' else [])
+        missing = [c for c in required if c not in columns]
+        if missing:
+            report.error(5, f"the {missing} column is missing")
+            result['issues'] = report.finish()
+            return result
+
+        id_pos = columns.index(id_column)
+        patient_pos = columns.index('PATIENT_ID') if datatype == 'SAMPLE_ATTRIBUTES' else None
+        typed = [(i, columns[i], types[i]) for i in range(min(width, len(types))) if types[i] in ('NUMBER', 'BOOLEAN')]
+        for n, line in enumerate(f, 6):
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != width:
+                report.error(n, f"{len(fields)} fields, the header has {width}", "wrong number of fields")
+                continue
+            value = fields[id_pos]
+            if not ID_PATTERN.fullmatch(value):
+                report.error(n, f"{id_column} '{value}' can only have letters, numbers, '.', '_' and '-'",
+                             f"{id_column} with other characters than letters, numbers, '.', '_' and '-'")
+            if value in ids:
+                report.error(n, f"{id_column} '{value}' is there more than once", f"duplicated {id_column}")
+            ids.add(value)
+            if patient_pos is not None:
+                patient = fields[patient_pos]
+                if not ID_PATTERN.fullmatch(patient):
+                    report.error(n, f"PATIENT_ID '{patient}' can only have letters, numbers, '.', '_' and '-'",
+                                 "PATIENT_ID with other characters than letters, numbers, '.', '_' and '-'")
+                patients.add(patient)
+            for i, column, col_type in typed:
+                value = fields[i]
+                if value.lower() in NULL_VALUES:
+                    continue
+                if col_type == 'NUMBER' and not _is_number(value):
+                    report.error(n, f"{column} is a NUMBER column, '{value}' is not a number",
+                                 f"values of the NUMBER column {column} that are not numbers")
+                elif col_type == 'BOOLEAN' and value not in BOOLEAN_TEXT:
+                    report.error(n, f"{column} is a BOOLEAN column, '{value}' is not TRUE or FALSE",
+                                 f"values of the BOOLEAN column {column} that are not TRUE or FALSE")
+    result['issues'] = report.finish()
+    return result
+
+
+def check_gene_panel_matrix(path, name):
+    """Checks data_gene_panel_matrix.txt, returns its issues and its samples."""
+    report = _FileReport(name)
+    samples = set()
+    with open(path, newline='') as f:
+        header = f.readline().rstrip('\r\n').split('\t')
+        if header[0] != 'SAMPLE_ID':
+            report.error(1, "the first column is SAMPLE_ID")
+        for n, line in enumerate(f, 2):
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != len(header):
+                report.error(n, f"{len(fields)} fields, the header has {len(header)}", "wrong number of fields")
+            samples.add(fields[0])
+    return {'issues': report.finish(), 'ids': samples}
+
+
+def _check_file(job):
+    func, *arguments = job
+    return func(*arguments)
+
+
+def study_files(study_dir):
+    """Meta and case list files of a study (relative names), sorted."""
+    names = [name for name in os.listdir(study_dir)
+             if name.startswith('meta_') and name.endswith('.txt') and os.path.isfile(os.path.join(study_dir, name))]
+    case_dir = os.path.join(study_dir, 'case_lists')
+    if os.path.isdir(case_dir):
+        names += [os.path.join('case_lists', name) for name in os.listdir(case_dir) if name.endswith('.txt')]
+    return sorted(names)
+
+
+def _run_jobs(jobs, workers):
+    if workers <= 1 or len(jobs) < 2:
+        return [_check_file(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(_check_file, jobs))
+
+
+def validate_study(study_dir, jobs=None):
+    """
+    Checks every meta, data and case list file of a study directory, jobs files at a time
+    (default: the number of cores). Returns the Issues found, errors first.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    issues = []
+    if not os.path.isfile(os.path.join(study_dir, 'meta_study.txt')):
+        issues.append(Issue('ERROR', 'meta_study.txt', None, "the study has no meta_study.txt"))
+
+    meta_names = study_files(study_dir)
+    metas = dict(zip(meta_names, _run_jobs([(check_meta_file, os.path.join(study_dir, name), name)
+                                            for name in meta_names], jobs)))
+    data_jobs = {}
+    for name, meta in metas.items():
+        issues += meta['issues']
+        fields = meta['fields']
+        data_name = fields.get('data_filename')
+        if not data_name:
+            continue
+        data_path = os.path.join(study_dir, data_name)
+        if not os.path.isfile(data_path):
+            issues.append(Issue('ERROR', name, None, f"data_filename {data_name} is not in the study directory"))
+        elif fields.get('datatype') in ('PATIENT_ATTRIBUTES', 'SAMPLE_ATTRIBUTES'):
+            data_jobs[fields['datatype']] = (check_clinical_file, data_path, data_name, fields['datatype'])
+        elif fields.get('datatype') == 'GENE_PANEL_MATRIX':
+            data_jobs['GENE_PANEL_MATRIX'] = (check_gene_panel_matrix, data_path, data_name)
+    data = dict(zip(data_jobs, _run_jobs(list(data_jobs.values()), jobs)))
+    for checked in data.values():
+        issues += checked['issues']
+
+    # between the files: one study id, samples of known patients, case lists and panels of known samples
+    study_ids = {meta['fields'].get('cancer_study_identifier') for meta in metas.values()} - {None, ''}
+    if len(study_ids) > 1:
+        issues.append(Issue('ERROR', 'meta_study.txt', None,
+                            f"the files name different cancer_study_identifiers: {sorted(study_ids)}"))
+    patients = data.get('PATIENT_ATTRIBUTES', {}).get('ids')
+    samples = data.get('SAMPLE_ATTRIBUTES', {}).get('ids')
+    if samples is None:
+        issues.append(Issue('ERROR', 'meta_study.txt', None, "the study has no clinical sample file"))
+    if patients is not None and samples is not None:
+        unknown = data['SAMPLE_ATTRIBUTES']['patients'] - patients
+        if unknown:
+            issues.append(Issue('ERROR', data_jobs['SAMPLE_ATTRIBUTES'][2], None,
+                                f"{len(unknown)} sample(s) refer to patients not in the patient file, "
+                                f"e.g. {sorted(unknown)[:5]}"))
+    if samples is not None:
+        for name, meta in metas.items():
+            listed = meta['fields'].get('case_list_ids')
+            if listed is not None:
+                unknown = set(listed.split('\t')) - {''} - samples
+                if unknown:
+                    issues.append(Issue('ERROR', name, None, f"{len(unknown)} case list sample(s) are not in the "
+                                                             f"sample file, e.g. {sorted(unknown)[:5]}"))
+        if 'GENE_PANEL_MATRIX' in data:
+            unknown = data['GENE_PANEL_MATRIX']['ids'] - samples
+            if unknown:
+                issues.append(Issue('ERROR', data_jobs['GENE_PANEL_MATRIX'][2], None,
+                                    f"{len(unknown)} sample(s) are not in the sample file, e.g. {sorted(unknown)[:5]}"))
+    return sorted(issues, key=lambda i: (i.level != 'ERROR', i.file, i.line or float('inf')))
+
+
+def print_report(issues, study_dir, seconds=None, limit=50):
+    """Prints the issues, returns the number of errors."""
+    errors = sum(i.level == 'ERROR' for i in issues)
+    took = f" in {seconds:.2f} s" if seconds is not None else ""
+    print(f"\nValidated {study_dir}{took}: {errors} error(s), {len(issues) - errors} warning(s)")
+    for issue in issues[:limit]:
+        print(f"  {issue}")
+    if len(issues) > limit:
+        print(f"  ... and {len(issues) - limit} more")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("study_dir", help="study directory written by the parser")
+    parser.add_argument("-j", "--jobs", dest='jobs', type=int, default=os.cpu_count() or 1,
+                        help="Number of files checked at the same time (default: number of cores)")
+    args = parser.parse_args()
+    if not os.path.isdir(args.study_dir):
+        print(f"Error: {args.study_dir} is not a directory.")
+        return 1
+    start = time.perf_counter()
+    issues = validate_study(args.study_dir, args.jobs)
+    return 1 if print_report(issues, args.study_dir, time.perf_counter() - start) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
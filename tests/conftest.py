@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cBioportal_study_parser_v3_1 as parser_v3  # noqa: E402
+
+
+@pytest.fixture
+def clinical_csv(tmp_path):
+    """Writes the lines as tmp_path/clinical.csv and returns its path."""
+    def write(*lines):
+        source = tmp_path / "clinical.csv"
+        source.write_text("\n".join(lines) + "\n")
+        return source
+    return write
+
+
+@pytest.fixture
+def study_config(tmp_path):
+    """The config dict of a study named 'study' converted from source into tmp_path, with more keys."""
+    def config(source, **values):
+        return dict({'file': str(source), 'study_name': 'study', 'work_dir': str(tmp_path),
+                     'cancer_type': 'coad'}, **values)
+    return config
+
+
+@pytest.fixture
+def convert(study_config, tmp_path):
+    """Converts source with convert_study() and returns the study directory."""
+    def run(source, **values):
+        parser_v3.convert_study(study_config(source, **values))
+        return tmp_path / "study"
+    return run
+
+
+@pytest.fixture
+def case_list_ids():
+    """The sample ids of a case list file."""
+    def read(path):
+        with open(path) as f:
+            return [line for line in f if line.startswith("case_list_ids:")][0].split(":", 1)[1].split()
+    return read
@@ -0,0 +1,26 @@
+import pytest
+
+import cBioportal_study_parser_v3_1 as parser_v3
+
+CASE_LISTS = {'kras_mut': {'where': {'Kras': 'mut'}},
+              'female': {'where': {'GENDER': 'F', 'kras': ['wt', 'mut']}}}
+
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_where_columns_match_the_renamed_header(clinical_csv, convert, case_list_ids, chunksize):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,GENDER,KRAS",
+                          "P1,S1,F,mut",
+                          "P2,S2,M,mut",
+                          "P3,S3,F,wt",
+                          "P4,S4,F,NA")
+    values = {'chunksize': chunksize} if chunksize else {}
+    case_lists = convert(source, case_lists=CASE_LISTS, **values) / "case_lists"
+    assert case_list_ids(case_lists / "cases_kras_mut.txt") == ['S1', 'S2']
+    assert case_list_ids(case_lists / "cases_female.txt") == ['S1', 'S3']
+
+
+def test_dry_run_rejects_an_unknown_where_column(clinical_csv, study_config):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,KRAS", "P1,S1,mut")
+    config = parser_v3.StudyConfig.from_dict(study_config(source, case_lists={'braf': {'where': {'BRAF': 'mut'}}}))
+    with pytest.raises(parser_v3.StudyConversionError, match="BRAF"):
+        parser_v3.dry_run(config)
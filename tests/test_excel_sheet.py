@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from openpyxl import Workbook
+
+import cBioportal_study_parser_v3_1 as parser_v3
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / "clinical.xlsx"
+    book = Workbook()
+    book.active.title = "2019"
+    book.active.append(["PATIENT_ID", "AGE"])
+    book.active.append(["P1", 50])
+    second = book.create_sheet("2020")
+    second.append(["PATIENT_ID", "SEX"])
+    second.append(["P1", "F"])
+    book.save(path)
+    return str(path)
+
+
+def test_digit_sheet_is_a_name_when_the_workbook_has_it(workbook):
+    assert parser_v3.read_input_header(workbook, "2020") == ["PATIENT_ID", "SEX"]
+    assert next(parser_v3._excel_rows(workbook, "2019")) == ("PATIENT_ID", "AGE")
+
+
+def test_digit_sheet_is_an_index_otherwise(workbook):
+    assert parser_v3.read_input_header(workbook, "1") == ["PATIENT_ID", "SEX"]
+    assert next(parser_v3._excel_rows(workbook, "0")) == ("PATIENT_ID", "AGE")
+    assert parser_v3.StudyConfig.from_dict({'file': workbook, 'study_name': 'study', 'sheet': '2020'}).sheet == '2020'
+    with pytest.raises(parser_v3.StudyConversionError):
+        parser_v3.read_input_header(workbook, "5")
+
+
+def test_index_and_name_share_one_parquet_copy(workbook):
+    pytest.importorskip("pyarrow")
+    first = parser_v3.read_excel_file(workbook, 0)
+    assert os.path.exists(workbook + ".2019.parquet")
+    for sheet in ("0", "2019"):
+        assert parser_v3._fresh_excel_cache(workbook, parser_v3.excel_sheet_name(workbook, sheet))
+        assert parser_v3.read_excel_file(workbook, sheet).columns.tolist() == first.columns.tolist()
+    parser_v3.read_excel_file(workbook, "1")
+    assert sorted(name for name in os.listdir(os.path.dirname(workbook)) if name.endswith(".parquet")) == [
+        "clinical.xlsx.2019.parquet", "clinical.xlsx.2020.parquet"]
@@ -0,0 +1,51 @@
+import pandas as pd
+
+import cBioportal_study_parser_v3_1 as parser_v3
+
+
+def test_variants_are_mutations():
+    assert parser_v3._mutation_code("G12D") == 1
+    assert parser_v3._mutation_code("V600E") == 1
+    assert parser_v3._mutation_code("mut") == 1
+    assert parser_v3._mutation_code("wt") == 0
+    assert parser_v3._mutation_code("0") == 0
+    assert parser_v3._mutation_code("NA") == -1
+    assert parser_v3._mutation_code("not tested") == -1
+    assert parser_v3._mutation_code("G12G") == 0
+    assert parser_v3._mutation_code("p.V600V") == 0
+
+
+def test_gene_matrix_with_variant_strings():
+    df = pd.DataFrame({'SAMPLE_ID': ['S1', 'S2', 'S3', 'S4'],
+                       'KRAS': ['wt', 'G12V', 'G12D', None],
+                       'BRAF': ['V600E', 'wt', None, None]})
+    matrix = parser_v3.GeneMatrix.from_frame(df, ['KRAS', 'BRAF'])
+    assert matrix.codes.tolist() == [[0, 1], [1, 0], [1, -1], [-1, -1]]
+    assert matrix.samples[matrix.profiled()].tolist() == ['S1', 'S2', 'S3']
+
+
+def test_variant_samples_are_sequenced(clinical_csv, convert, case_list_ids):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,AGE,KRAS",
+                          "P1,S1,50,wt",
+                          "P2,S2,61,mut",
+                          "P3,S3,70,G12D",
+                          "P4,S4,44,")
+    study = convert(source, gene_panel='P1')
+    assert case_list_ids(study / "case_lists" / "cases_sequenced.txt") == ['S1', 'S2', 'S3']
+    panel = pd.read_csv(study / "data_gene_panel_matrix.txt", sep="\t")
+    assert panel.set_index('SAMPLE_ID')['mutations'].fillna('NA').to_dict() == {
+        'S1': 'P1', 'S2': 'P1', 'S3': 'P1', 'S4': 'NA'}
+
+
+def test_mutation_profile_has_the_protein_changes_only(clinical_csv, convert, case_list_ids):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,KRAS,BRAF",
+                          "P1,S1,G12D,wt",
+                          "P2,S2,mut,p.V600E",
+                          "P3,S3,G12G,",
+                          "P4,S4,Q61*,yes")
+    study = convert(source, gene_panel='P1')
+    maf = pd.read_csv(study / "data_mutations.txt", sep="\t")
+    assert maf.values.tolist() == [['KRAS', 'S1', 'Missense_Mutation', 'p.G12D'],
+                                   ['KRAS', 'S4', 'Nonsense_Mutation', 'p.Q61*'],
+                                   ['BRAF', 'S2', 'Missense_Mutation', 'p.V600E']]
+    assert case_list_ids(study / "case_lists" / "cases_sequenced.txt") == ['S1', 'S2', 'S3', 'S4']
@@ -0,0 +1,19 @@
+import sys
+
+import cBioportal_study_parser_v2 as parser_v2
+
+
+def test_month_values_reach_the_patient_file(clinical_csv, tmp_path, monkeypatch):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,AGE,OS_MONTHS,DFS_MONTHS,SEX",
+                          "P1,S1,50,12.5,3,F",
+                          "P2,S2,61,40,,M")
+    monkeypatch.setattr(sys, 'argv', ['cBioportal_study_parser_v2.py', '-f', str(source), '-n', 'study',
+                                      '-ct', 'coad', '-csi', 'study', '-wd', str(tmp_path)])
+    parser_v2.main()
+    with open(tmp_path / "study" / "data_clinical_patient.txt") as f:
+        lines = [line.rstrip('\n').lstrip('#').split('\t') for line in f]
+    types = dict(zip(lines[4], lines[2]))
+    assert types['OS_MONTHS'] == types['DFS_MONTHS'] == 'NUMBER'
+    rows = {row[0]: dict(zip(lines[4], row)) for row in lines[5:]}
+    assert [rows['P1']['OS_MONTHS'], rows['P1']['DFS_MONTHS']] == ['12.5', '3.0']
+    assert [rows['P2']['OS_MONTHS'], rows['P2']['DFS_MONTHS']] == ['40.0', '']
@@ -0,0 +1,13 @@
+import cBioportal_study_parser_v3_1 as parser_v3
+
+
+def test_header_with_a_byte_order_mark(tmp_path, convert, study_config):
+    source = tmp_path / "clinical.csv"
+    source.write_bytes("PATIENT_ID,SAMPLE_ID,AGE,NOTES\n007,S1,50,x\n008,S2,61,y\n".encode('utf-8-sig'))
+    assert parser_v3.read_input_header(str(source))[0] == 'PATIENT_ID'
+    config = parser_v3.StudyConfig.from_dict(study_config(source))
+    usecols, dtype = parser_v3.read_plan(config)
+    assert dtype == {'PATIENT_ID': str, 'SAMPLE_ID': str}
+    study = convert(source)
+    with open(study / "data_clinical_patient.txt") as f:
+        assert [line.split('\t')[0] for line in f.read().splitlines()[5:]] == ['007', '008']
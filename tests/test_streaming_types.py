@@ -0,0 +1,21 @@
+from cBioportal_study_validator import validate_study
+
+
+def header(path):
+    with open(path) as f:
+        lines = [next(f).rstrip('\n').lstrip('#').split('\t') for _ in range(5)]
+    return dict(zip(lines[4], lines[2]))
+
+
+def test_later_chunk_widens_the_column_type(clinical_csv, convert):
+    rows = [f"P{i},S{i},{50 + i},{i % 3 + 1}" for i in range(6)] + ["P6,S6,70,G3", "P7,S7,71,2"]
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,AGE,GRADE", *rows)
+    study = convert(source, chunksize=3, patient_columns=['PATIENT_ID', 'AGE'])
+    sample_file = study / "data_clinical_sample.txt"
+    types = header(sample_file)
+    assert types['GRADE'] == 'STRING'
+    with open(sample_file) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 5 + 8
+    assert lines[-2].split('\t')[-1] == 'G3'
+    assert [issue for issue in validate_study(str(study), jobs=1) if issue.level == 'ERROR'] == []
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from cBioportal_study_validator import validate_study
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_rerun_removes_the_files_it_no_longer_writes(clinical_csv, convert, incremental):
+    source = clinical_csv("PATIENT_ID,SAMPLE_ID,AGE,KRAS",
+                          "P1,S1,50,G12D",
+                          "P2,S2,61,wt")
+    study = convert(source, gene_panel='P1', incremental=incremental,
+                    case_lists={'kras_mut': {'where': {'KRAS': 'G12D'}}})
+    assert os.path.exists(study / "data_gene_panel_matrix.txt")
+    assert os.path.exists(study / "case_lists" / "cases_kras_mut.txt")
+
+    convert(source, incremental=incremental)
+    left = sorted(os.listdir(study))
+    assert [name for name in left if 'gene_panel' in name or 'mutations' in name] == []
+    assert os.listdir(study / "case_lists") == ["cases_all.txt"]
+    assert [issue for issue in validate_study(str(study), jobs=1) if issue.level == 'ERROR'] == []
@@ -0,0 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cBioportal_study_parser_v3_1 as parser_v3
+
+
+def test_threads_add_up_into_one_stage():
+    stages = {}
+
+    def write(_):
+        with parser_v3.timed_stage(stages, 'write') as measured:
+            measured['bytes_written'] = 10
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(write, range(400)))
+    assert stages['write']['calls'] == 400
+    assert stages['write']['bytes_written'] == 4000
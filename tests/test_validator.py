@@ -0,0 +1,22 @@
+from cBioportal_study_validator import _FileReport, read_meta_file
+
+
+def meta_errors(tmp_path, text):
+    path = tmp_path / "meta_study.txt"
+    path.write_text(text)
+    report = _FileReport(path.name)
+    read_meta_file(str(path), report)
+    return [issue.message for issue in report.finish() if issue.level == 'ERROR']
+
+
+def test_glued_field_is_an_error(tmp_path):
+    errors = meta_errors(tmp_path, "type_of_cancer: coad\n"
+                                   "add_global_case_list: falsereference_genome: hg38\n")
+    assert errors == ["'add_global_case_list' runs into 'reference_genome:', a line break is missing"]
+
+
+def test_colon_in_free_text_is_not_an_error(tmp_path):
+    assert meta_errors(tmp_path, "type_of_cancer: coad\n"
+                                 "name: short_name: x name: y\n"
+                                 "description: KRAS study, see citation: Smith 2015\n"
+                                 "citation: Smith et al. name: Cancer 2015\n") == []